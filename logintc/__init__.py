@@ -6,8 +6,26 @@ LoginTC organizations, users, domains, tokens and to create login sessions.
 __version_info__ = ('1', '1', '9')
 __version__ = '.'.join(__version_info__)
 
-from logintc.client import LoginTC
-from logintc.client import LoginTCException
-from logintc.client import InternalAPIException
-from logintc.client import APIException
-from logintc.client import NoTokenException
+from logintc.exceptions import LoginTCException
+from logintc.exceptions import InternalAPIException
+from logintc.exceptions import APIException
+from logintc.exceptions import NoTokenException
+from logintc.exceptions import TimeoutException
+from logintc.exceptions import OverloadedException
+
+# The client pulls in httplib2 and its TLS and proxy support, so it is only
+# imported when first used.
+_LAZY_ATTRIBUTES = {'LoginTC': 'logintc.client'}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        import importlib
+        value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module 'logintc' has no attribute '%s'" % name)
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_ATTRIBUTES))
@@ -0,0 +1,226 @@
+"""
+Lookup cache backends for the LoginTC client.
+
+A cache backend stores the JSON text of lookup results (users and domains)
+under string keys. Entries older than their TTL are still returned, flagged
+as stale, so that the client can answer immediately and refresh the entry in
+the background.
+
+MemoryCache is private to a process. SharedCache is shared by every process
+on a host that opens the same file.
+"""
+
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryCache(object):
+    """
+    In-process cache holding up to max_entries entries, evicting the least
+    recently used entry first.
+    """
+
+    def __init__(self, ttl=300, max_entries=100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns a (value, stale) tuple, or None if key is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+
+        value, expires = entry
+        return value, time.time() >= expires
+
+    def set(self, key, value, fetched=None):
+        """
+        Cache value under key. fetched is the time the value was fetched from
+        the API and defaults to now.
+        """
+        if fetched is None:
+            fetched = time.time()
+
+        with self._lock:
+            self._entries[key] = (value, fetched + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self, prefix=''):
+        """
+        Remove every entry whose key starts with prefix.
+        """
+        with self._lock:
+            if not prefix:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries
+                        if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def after_fork(self):
+        """
+        Keep the cached entries but replace the lock, which may have been
+        held by another thread when the process forked.
+        """
+        self._lock = threading.Lock()
+
+
+def _private_directory(parent):
+    """
+    Returns a directory in parent that only the current user can access,
+    creating it if needed. Raises PermissionError if it exists but belongs
+    to another user or others can access it.
+    """
+    path = os.path.join(parent, 'logintc-%d' % os.geteuid())
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.geteuid() or \
+            st.st_mode & 0o077:
+        raise PermissionError('%s is not a private directory' % path)
+    return path
+
+
+def _default_shared_path():
+    if not hasattr(os, 'geteuid'):
+        # The temporary directory is already private to the user.
+        return os.path.join(tempfile.gettempdir(), 'logintc-cache.db')
+
+    parent = '/dev/shm' if os.path.isdir('/dev/shm') \
+        else tempfile.gettempdir()
+    return os.path.join(_private_directory(parent), 'cache.db')
+
+
+class SharedCache(object):
+    """
+    Cache shared by all processes on a host, stored in a memory-mapped SQLite
+    database indexed by key.
+
+    By default the database lives in a directory private to the current
+    user in /dev/shm (RAM-backed on Linux) or the temporary directory, so
+    only processes running as the same user share it. The database must be
+    owned by the current user and not accessible by others; it is created
+    that way, and PermissionError is raised otherwise. Entries more than ttl
+    seconds past their expiry are pruned, as are the oldest entries beyond
+    max_entries.
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path=None, ttl=300, max_entries=1000000,
+                 mmap_size=256 * 1024 * 1024):
+        self.path = path or _default_shared_path()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.mmap_size = mmap_size
+        self._writes = 0
+        self.after_fork()
+
+    def after_fork(self):
+        """
+        Open a new database connection; SQLite connections must not be used
+        across fork.
+        """
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        # Entries hold user information, so the file is created private; the
+        # WAL and shared-memory files take the same permissions. A file
+        # someone else could read or write is refused.
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT |
+                     getattr(os, 'O_NOFOLLOW', 0), 0o600)
+        try:
+            st = os.fstat(fd)
+        finally:
+            os.close(fd)
+        if hasattr(os, 'geteuid') and \
+                (st.st_uid != os.geteuid() or st.st_mode & 0o077):
+            raise PermissionError('%s is not private to this user' %
+                                  self.path)
+
+        self._db = sqlite3.connect(self.path, timeout=10,
+                                   check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute('PRAGMA mmap_size=%d' % self.mmap_size)
+        self._db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                         'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                         'expires REAL NOT NULL)')
+
+    def _execute(self, sql, params=()):
+        if self._pid != os.getpid():
+            self.after_fork()
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def get(self, key):
+        """
+        Returns a (value, stale) tuple, or None if key is not cached.
+        """
+        rows = self._execute('SELECT value, expires FROM entries '
+                             'WHERE key = ?', (key,))
+        if not rows:
+            return None
+
+        value, expires = rows[0]
+        return value, time.time() >= expires
+
+    def set(self, key, value, fetched=None):
+        """
+        Cache value under key. fetched is the time the value was fetched from
+        the API and defaults to now.
+        """
+        if fetched is None:
+            fetched = time.time()
+
+        self._execute('INSERT OR REPLACE INTO entries (key, value, expires) '
+                      'VALUES (?, ?, ?)', (key, value, fetched + self.ttl))
+
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        """
+        Remove long-expired entries and the oldest entries beyond
+        max_entries.
+        """
+        self._execute('DELETE FROM entries WHERE expires < ?',
+                      (time.time() - self.ttl,))
+        self._execute('DELETE FROM entries WHERE key IN (SELECT key FROM '
+                      'entries ORDER BY expires DESC LIMIT -1 OFFSET ?)',
+                      (self.max_entries,))
+
+    def delete(self, key):
+        self._execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def clear(self, prefix=''):
+        """
+        Remove every entry whose key starts with prefix.
+        """
+        self._execute('DELETE FROM entries WHERE substr(key, 1, ?) = ?',
+                      (len(prefix), prefix))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
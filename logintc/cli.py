@@ -0,0 +1,238 @@
+"""
+The logintc command-line tool.
+
+Reads one operation per input row from stdin, as NDJSON (one JSON object per
+line) or CSV with a header row, runs the operations concurrently and writes
+one NDJSON result per row to stdout as they complete. A throughput summary
+is printed to stderr at the end.
+
+Example::
+
+    $ export LOGINTC_API_KEY=...
+    $ logintc --concurrency 20 --rate 50 user-create < users.ndjson
+    $ logintc --format csv --domain-id 892e64... token-issue < users.csv
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from logintc.client import LoginTC, _RateLimiter
+from logintc.exceptions import APIException
+
+
+def _user_create(client, row):
+    return client.create_user(row['username'], row['email'], row['name'])
+
+
+def _user_update(client, row):
+    return client.update_user(row['user_id'], email=row.get('email'),
+                              name=row.get('name'))
+
+
+def _domain_user_add(client, row):
+    client.add_domain_user(row['domain_id'], row['user_id'])
+
+
+def _domain_user_remove(client, row):
+    client.remove_domain_user(row['domain_id'], row['user_id'])
+
+
+def _token_issue(client, row):
+    return client.create_user_token(row['domain_id'], row['user_id'])
+
+
+def _bypass_issue(client, row):
+    return client.create_bypass_code(
+        row['user_id'], int(row.get('uses_allowed') or 1),
+        int(row.get('expiration_time') or 0))
+
+
+OPERATIONS = {
+    'user-create': _user_create,
+    'user-update': _user_update,
+    'domain-user-add': _domain_user_add,
+    'domain-user-remove': _domain_user_remove,
+    'token-issue': _token_issue,
+    'bypass-issue': _bypass_issue,
+}
+
+
+class InvalidRow(object):
+    """
+    An input line that could not be parsed into a row.
+    """
+
+    def __init__(self, line, message):
+        self.line = line
+        self.message = message
+
+
+def read_rows(stream, format='ndjson'):
+    """
+    Read input rows from stream lazily.
+
+    Returns a generator of dicts, and of InvalidRow for NDJSON lines that
+    are not JSON objects.
+    """
+    if format == 'csv':
+        for row in csv.DictReader(stream):
+            yield dict((key, value) for key, value in row.items() if value)
+        return
+
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield InvalidRow(line.rstrip('\n'),
+                             'Invalid JSON on line %d: %s' % (number, e))
+            continue
+        if not isinstance(row, dict):
+            yield InvalidRow(line.rstrip('\n'),
+                             'Line %d is not a JSON object' % number)
+            continue
+        yield row
+
+
+def _result(row, future):
+    try:
+        return {'input': row, 'result': future.result()}
+    except KeyError as e:
+        return {'input': row,
+                'error': {'message': 'Missing field: %s' % e.args[0]}}
+    except APIException as e:
+        return {'input': row, 'error': {'code': e.code, 'message': str(e)}}
+    except Exception as e:
+        return {'input': row, 'error': {'message': str(e) or
+                                        e.__class__.__name__}}
+
+
+def run(client, operation, rows, out, concurrency=10, rate_limit=None,
+        defaults=None):
+    """
+    Run operation on every row with up to concurrency calls in flight and at
+    most rate_limit calls started per second, writing each result to out as
+    soon as it completes. Values in defaults fill in missing row fields.
+
+    Invalid rows are reported as failed without being run. If reading the
+    input fails, the error is reported as a failed row, the calls in flight
+    are finished and no more rows are read.
+
+    Returns a (succeeded, failed) tuple.
+    """
+    func = OPERATIONS[operation]
+    limiter = _RateLimiter(rate_limit) if rate_limit else None
+    counts = [0, 0]
+
+    def call(row):
+        if limiter is not None:
+            limiter.wait()
+        return func(client, row)
+
+    def write(result):
+        counts[1 if 'error' in result else 0] += 1
+        out.write(json.dumps(result, sort_keys=True))
+        out.write('\n')
+
+    def emit(done):
+        for future in done:
+            write(_result(pending.pop(future), future))
+        out.flush()
+
+    rows = iter(rows)
+    pending = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            try:
+                row = next(rows)
+            except StopIteration:
+                break
+            except Exception as e:
+                write({'error': {'message': 'Could not read input: %s' % e}})
+                break
+
+            if isinstance(row, InvalidRow):
+                write({'input': row.line, 'error': {'message': row.message}})
+                continue
+            if defaults:
+                row = dict(defaults, **row)
+            # Bound how much of the input is read ahead of the workers.
+            if len(pending) >= concurrency * 2:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                emit(done)
+            pending[executor.submit(call, row)] = row
+
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            emit(done)
+
+    out.flush()
+    return tuple(counts)
+
+
+def main(argv=None, stdin=None, stdout=None, stderr=None):
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+
+    parser = argparse.ArgumentParser(
+        prog='logintc',
+        description='Run LoginTC operations in bulk from rows read on stdin.')
+    parser.add_argument('operation', choices=sorted(OPERATIONS))
+    parser.add_argument('--api-key', default=os.environ.get('LOGINTC_API_KEY'),
+                        help='API key (default: $LOGINTC_API_KEY)')
+    parser.add_argument('--host', action='append',
+                        help='API host; repeat for failover '
+                             '(default: $LOGINTC_HOST or %s)' %
+                             LoginTC.DEFAULT_HOST)
+    parser.add_argument('--format', choices=['ndjson', 'csv'],
+                        default='ndjson', help='input format')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='requests in flight at once')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='adapt the requests in flight, up to '
+                             '--concurrency, to the API latency and errors')
+    parser.add_argument('--rate', type=float,
+                        help='maximum requests started per second')
+    parser.add_argument('--timeout', type=float,
+                        help='socket timeout of each request, in seconds')
+    parser.add_argument('--domain-id',
+                        help='domain_id for rows that do not have one')
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error('an API key is required (--api-key or LOGINTC_API_KEY)')
+
+    hosts = args.host or [os.environ.get('LOGINTC_HOST', LoginTC.DEFAULT_HOST)]
+    client = LoginTC(args.api_key, host=hosts, timeout=args.timeout,
+                     max_concurrency=args.concurrency if args.adaptive
+                     else None)
+    defaults = {'domain_id': args.domain_id} if args.domain_id else None
+
+    start = time.monotonic()
+    succeeded, failed = run(client, args.operation,
+                            read_rows(stdin, args.format), stdout,
+                            args.concurrency, args.rate, defaults)
+    elapsed = time.monotonic() - start
+
+    total = succeeded + failed
+    stderr.write('%d rows in %.2fs (%.1f/s): %d succeeded, %d failed\n' %
+                 (total, elapsed, total / elapsed if elapsed else 0.0,
+                  succeeded, failed))
+    if args.adaptive:
+        stats = client.concurrency_stats()
+        stderr.write('concurrency settled at %d (%d increases, %d decreases)\n'
+                     % (stats['limit'], stats['increases'],
+                        stats['decreases']))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,74 +6,1171 @@ Further documentation on the LoginTC REST API may be found at
 https://www.logintc.com/docs/rest-api/
 """
 
+import hashlib
+import heapq
+import http.client
 import json
+import os
+import re
+import socket
+import ssl
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import httplib2
 
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
 from logintc import __version__
+from logintc.cache import MemoryCache
+from logintc.exceptions import LoginTCException
+from logintc.exceptions import InternalAPIException
+from logintc.exceptions import APIException
+from logintc.exceptions import NoTokenException
+from logintc.exceptions import TimeoutException
+from logintc.membership import MembershipIndex
+
+# httplib2 decodes gzip and deflate itself; brotli is decoded by the pool.
+_ACCEPT_ENCODING = 'gzip, deflate, br' if brotli is not None else \
+    'gzip, deflate'
+
+_local = threading.local()
+
+
+def _current_deadline():
+    return getattr(_local, 'deadline', None)
+
+
+@contextmanager
+def _deadline(timeout=None, deadline=None):
+    """
+    Within the block, requests made by the current thread must complete
+    within timeout seconds, or by the absolute time.monotonic() deadline.
+    Nested deadlines can only shorten the enclosing one.
+    """
+    previous = _current_deadline()
+    current = previous
+
+    if timeout is not None:
+        deadline = time.monotonic() + timeout
+    if deadline is not None and (current is None or deadline < current):
+        current = deadline
+
+    _local.deadline = current
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def _remaining():
+    """
+    Returns the seconds left before the current deadline, or None if there
+    is no deadline. Raises TimeoutException if it has passed.
+    """
+    deadline = _current_deadline()
+    if deadline is None:
+        return None
+
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutException()
+    return remaining
+
+
+# The last TLS session negotiated with each (host, port, ca_certs), and the
+# SSL context it belongs to; sessions can only be resumed by their context.
+_tls_sessions = {}
+
+
+class _SessionResumingContext(object):
+    """
+    Wraps an ssl.SSLContext so that new connections offer a previously
+    negotiated TLS session, skipping the full handshake when the server
+    accepts it.
+    """
+
+    def __init__(self, context, session):
+        self._context = context
+        self._session = session
+
+    def wrap_socket(self, sock, server_hostname=None, **kwargs):
+        kwargs['session'] = self._session
+        return self._context.wrap_socket(
+            sock, server_hostname=server_hostname, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
+
+
+class _HTTPResponse(http.client.HTTPResponse):
+    """
+    HTTP response that reports the size of its body as received, before
+    httplib2 decompresses it, in a '-content-length' header.
+    """
+    wire_length = None
+
+    def read(self, amt=None):
+        data = http.client.HTTPResponse.read(self, amt)
+        if amt is None:
+            self.wire_length = len(data)
+        return data
+
+    def getheaders(self):
+        headers = http.client.HTTPResponse.getheaders(self)
+        if self.wire_length is not None:
+            headers.append(('-content-length', str(self.wire_length)))
+        return headers
+
+
+class _AbortableConnection(object):
+    """
+    Mixin for connections that abort() can interrupt from another thread.
+    An aborted connection refuses to reconnect, so that httplib2 does not
+    send the request again.
+    """
+    aborted = False
+
+    def abort(self):
+        self.aborted = True
+        sock = self.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _check_aborted(self):
+        if self.aborted:
+            raise ConnectionAbortedError('The request was abandoned.')
+
+
+class _HTTPConnection(_AbortableConnection,
+                      httplib2.HTTPConnectionWithTimeout):
+    response_class = _HTTPResponse
+
+    def connect(self):
+        self._check_aborted()
+        httplib2.HTTPConnectionWithTimeout.connect(self)
+
+
+class _HTTPSConnection(_AbortableConnection,
+                       httplib2.HTTPSConnectionWithTimeout):
+    """
+    HTTPS connection that resumes TLS sessions across reconnects.
+    """
+    response_class = _HTTPResponse
+
+    def connect(self):
+        self._check_aborted()
+        saved = _tls_sessions.get((self.host, self.port, self.ca_certs))
+        if saved is not None:
+            self._context = _SessionResumingContext(*saved)
+        httplib2.HTTPSConnectionWithTimeout.connect(self)
+
+
+class _ConnectionPool(object):
+    """
+    Thread-safe pool of httplib2.Http instances.
+
+    httplib2.Http is not safe to share between threads, so every request
+    checks out an idle instance (creating one if needed) and returns it to the
+    pool once the response has been read.
+
+    New instances are created by factory, if given, so that options such as
+    proxy_info, credentials or disable_ssl_certificate_validation apply to
+    every instance.
+    """
+
+    def __init__(self, ca_certs=None, timeout=None, factory=None):
+        self.ca_certs = ca_certs
+        self.timeout = timeout
+        self.factory = factory
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+
+        if self.factory is not None:
+            http = self.factory()
+        else:
+            http = httplib2.Http(ca_certs=self.ca_certs, timeout=self.timeout)
+        http.follow_all_redirects = True
+        return http
+
+    def _checkin(self, http):
+        with self._lock:
+            self._idle.append(http)
+
+    def size(self):
+        """
+        Returns the number of idle Http instances in the pool.
+        """
+        with self._lock:
+            return len(self._idle)
+
+    def after_fork(self):
+        """
+        Drop the connections inherited from the parent process.
+        """
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _set_timeout(http, timeout):
+        http.timeout = timeout
+        for conn in http.connections.values():
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+
+    @staticmethod
+    def _save_tls_sessions(http):
+        # TLS 1.3 session tickets only arrive after the handshake, so the
+        # session is saved once a response has been read.
+        for conn in http.connections.values():
+            sock = conn.sock
+            if isinstance(sock, ssl.SSLSocket) and sock.session is not None:
+                _tls_sessions[(conn.host, conn.port, conn.ca_certs)] = \
+                    (sock.context, sock.session)
+
+    @staticmethod
+    def _aborted(http):
+        return any(getattr(conn, 'aborted', False)
+                   for conn in http.connections.values())
+
+    @staticmethod
+    def _close(http):
+        for conn in http.connections.values():
+            conn.close()
+        http.connections.clear()
+
+    def request(self, uri, method, headers=None, body=None, timeout=None):
+        """
+        Send a request on a pooled connection. timeout overrides the pool's
+        socket timeout for this request only.
+        """
+        connection_type = _HTTPSConnection if uri.startswith('https:') \
+            else _HTTPConnection
+
+        headers = dict(headers or {})
+        if not any(name.lower() == 'accept-encoding' for name in headers):
+            headers['Accept-Encoding'] = _ACCEPT_ENCODING
+
+        # The primary attempt of a hedged request can be aborted while it
+        # holds this Http, and only then.
+        call = getattr(_local, 'hedged_call', None)
+
+        http = self._checkout()
+        self._set_timeout(http, self.timeout if timeout is None else timeout)
+        try:
+            if call is not None:
+                call.attach(http)
+            response, content = http.request(
+                uri, method, headers=headers, body=body,
+                connection_type=connection_type)
+            self._save_tls_sessions(http)
+        except Exception:
+            # The connection may have been left mid-response.
+            self._close(http)
+            raise
+        finally:
+            if call is not None:
+                call.detach(http)
+            # An abort that raced with the response leaves a shut down
+            # socket behind.
+            if self._aborted(http):
+                self._close(http)
+            self._checkin(http)
+
+        if brotli is not None and response.get('content-encoding') == 'br':
+            try:
+                content = brotli.decompress(content)
+            except brotli.error:
+                # Raised the way httplib2 reports bad gzip content.
+                raise httplib2.FailedToDecompressContent(
+                    'Content purported to be compressed with br but failed '
+                    'to decompress.', response, '')
+            response['content-length'] = str(len(content))
+            response['-content-encoding'] = response.pop('content-encoding')
+
+        return response, content
 
 
-class LoginTCException(Exception):
+class _RateLimiter(object):
     """
-    A generic LoginTC client exception.
+    Spaces out calls so that no more than rate of them start per second.
     """
-    pass
 
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
 
-class InternalAPIException(LoginTCException):
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _SingleFlight(object):
     """
-    Exception caused by internal client exception.
+    Coalesces concurrent calls that share a key so that only the first one
+    runs and the others wait for and share its result or exception.
     """
 
+    class _Call(object):
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
     def __init__(self):
-        LoginTCException.__init__(
-            self, 'Something went wrong. Please try again.')
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """
+        Run func, or wait for the identical call already in flight. Waiting
+        is bounded by the current deadline. If the call in flight times out,
+        waiters with time left run it again.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = self._Call()
+
+            if leader:
+                break
+
+            if not call.done.wait(_remaining()):
+                raise TimeoutException()
+            if isinstance(call.error, TimeoutException):
+                # The leader ran out of its own time; retry within ours.
+                _remaining()
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+
+class _HedgedCall(object):
+    """
+    The outcome of a hedged request: the first (hedge, ok, value) reported
+    by either attempt, and the Http the primary attempt currently holds, so
+    that abort() can interrupt it.
+    """
+
+    def __init__(self, func, deadline):
+        self.func = func
+        self.deadline = deadline
+        self.outcome = None
+        self.aborted = False
+        self._http = None
+        self._lock = threading.Lock()
+
+    def finish(self, hedge, ok, value):
+        """
+        Report an attempt's outcome. Returns True if it was the first.
+        """
+        with self._lock:
+            if self.outcome is not None:
+                return False
+            self.outcome = (hedge, ok, value)
+            return True
+
+    def attach(self, http):
+        """
+        Record that the primary attempt is sending a request on http.
+        Raises ConnectionAbortedError if the call was already aborted.
+        """
+        with self._lock:
+            if self.aborted:
+                raise ConnectionAbortedError('The request was abandoned.')
+            self._http = http
+
+    def detach(self, http):
+        with self._lock:
+            if self._http is http:
+                self._http = None
+
+    def abort(self):
+        """
+        Interrupt the primary attempt's request, if it is still sending one.
+        """
+        with self._lock:
+            self.aborted = True
+            if self._http is not None:
+                for conn in list(self._http.connections.values()):
+                    if isinstance(conn, _AbortableConnection):
+                        conn.abort()
+
+
+def _attempt_abandoned():
+    """
+    Returns True if the current thread's request is the primary attempt of a
+    hedged request that the hedge has already answered.
+    """
+    call = getattr(_local, 'hedged_call', None)
+    return call is not None and call.outcome is not None
+
+
+class _Hedger(object):
+    """
+    Hedges idempotent requests: if a request has not answered within the
+    given percentile of recent latencies, a second copy is sent and whichever
+    answers first is used.
+
+    The first attempt runs in the calling thread. A scheduler thread sends
+    the hedges that are due from a pool of up to workers threads; when a
+    hedge answers first, the first attempt's connection is aborted if it is
+    still waiting for its response.
+
+    Hedged requests are capped at max_ratio of all requests, and no request
+    is hedged until min_samples latencies have been observed.
+    """
+
+    def __init__(self, percentile=95, max_ratio=0.05, window=1000,
+                 min_samples=20, workers=4, idle_timeout=60):
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.workers = workers
+        self.idle_timeout = idle_timeout
+        self._latencies = deque(maxlen=window)
+        self._stats = {'requests': 0, 'hedged': 0, 'wins': 0}
+        self.after_fork()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._due = []
+        self._seq = 0
+        self._scheduler = None
+        self._pool = None
+
+    def _record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _delay(self):
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+
+        index = int(len(latencies) * self.percentile / 100.0)
+        return latencies[min(index, len(latencies) - 1)]
+
+    def _may_hedge(self):
+        with self._lock:
+            if self._stats['hedged'] + 1 > \
+                    self.max_ratio * self._stats['requests']:
+                return False
+            self._stats['hedged'] += 1
+            return True
+
+    def _schedule(self, at, call):
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._due, (at, self._seq, call))
+            if self._scheduler is None:
+                self._scheduler = threading.Thread(target=self._run_scheduler)
+                self._scheduler.daemon = True
+                self._scheduler.start()
+            self._cond.notify()
+
+    def _run_scheduler(self):
+        # Exits after idle_timeout seconds without anything scheduled.
+        while True:
+            with self._cond:
+                while True:
+                    if not self._due:
+                        if not self._cond.wait(self.idle_timeout) and \
+                                not self._due:
+                            self._scheduler = None
+                            return
+                        continue
+                    wait = self._due[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                _, _, call = heapq.heappop(self._due)
+                if call.outcome is None and self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix='logintc-hedge')
+                pool = self._pool
+
+            if call.outcome is None and self._may_hedge():
+                pool.submit(self._hedge, call)
+
+    def _hedge(self, call):
+        start = time.monotonic()
+        try:
+            with _deadline(deadline=call.deadline):
+                outcome = (True, call.func())
+        except Exception as e:
+            outcome = (False, e)
+        self._record(time.monotonic() - start)
+
+        if call.finish(True, *outcome):
+            with self._lock:
+                self._stats['wins'] += 1
+            call.abort()
+
+    def run(self, func):
+        """
+        Run func, hedged if it is slow.
+        """
+        with self._lock:
+            self._stats['requests'] += 1
+
+        delay = self._delay()
+        if delay is None:
+            start = time.monotonic()
+            try:
+                return func()
+            finally:
+                self._record(time.monotonic() - start)
+
+        call = _HedgedCall(func, _current_deadline())
+        self._schedule(time.monotonic() + delay, call)
+
+        previous = getattr(_local, 'hedged_call', None)
+        _local.hedged_call = call
+        start = time.monotonic()
+        try:
+            outcome = (True, func())
+        except Exception as e:
+            outcome = (False, e)
+        finally:
+            _local.hedged_call = previous
+
+        if call.finish(False, *outcome):
+            self._record(time.monotonic() - start)
+
+        _, ok, value = call.outcome
+        if ok:
+            return value
+        raise value
+
+
+class _HostSelector(object):
+    """
+    Tracks the latency and errors of each API host and picks the fastest
+    healthy one. Hosts that have not answered yet are tried first. A host
+    that fails is avoided for a backoff period that doubles with each
+    consecutive failure, up to max_backoff seconds.
+    """
+
+    def __init__(self, hosts, alpha=0.3, max_backoff=60):
+        self.hosts = list(hosts)
+        self.alpha = alpha
+        self.max_backoff = max_backoff
+        self._stats = dict((host, {'latency': None, 'errors': 0,
+                                   'down_until': 0.0}) for host in hosts)
+        self._lock = threading.Lock()
+
+    def choose(self, exclude=()):
+        """
+        Returns the host to use next, or None if all hosts are excluded.
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [host for host in self.hosts if host not in exclude]
+            if not candidates:
+                return None
+
+            healthy = [host for host in candidates
+                       if self._stats[host]['down_until'] <= now]
+            if not healthy:
+                return min(candidates,
+                           key=lambda host: self._stats[host]['down_until'])
+
+            return min(healthy, key=lambda host: (
+                self._stats[host]['latency'] is not None,
+                self._stats[host]['latency']))
+
+    def success(self, host, latency):
+        with self._lock:
+            stats = self._stats[host]
+            if stats['latency'] is None:
+                stats['latency'] = latency
+            else:
+                stats['latency'] += self.alpha * (latency - stats['latency'])
+            stats['errors'] = 0
+            stats['down_until'] = 0.0
+
+    def failure(self, host):
+        with self._lock:
+            stats = self._stats[host]
+            stats['errors'] += 1
+            stats['down_until'] = time.monotonic() + min(
+                2 ** (stats['errors'] - 1), self.max_backoff)
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return dict((host, {'latency': stats['latency'],
+                                'errors': stats['errors'],
+                                'healthy': stats['down_until'] <= now})
+                        for host, stats in self._stats.items())
+
+
+class _AdaptiveLimiter(object):
+    """
+    Limits the number of requests in flight, adjusting the limit between
+    min_limit and max_limit from the responses (AIMD).
+
+    Every successful response received while the limit was in use raises
+    the limit by 1/limit, so about one per round trip. The limit is
+    multiplied by backoff on an error or a 429 or 5xx response, and when the
+    recent latency (a moving average) rises above tolerance times the
+    baseline latency (the lowest recent latency, slowly rising), which means
+    requests are queueing rather than jittering. It is lowered at most once
+    per recent latency so that one burst of slow responses counts once, and
+    latency is only judged once min_samples responses have been seen.
+    """
+
+    def __init__(self, max_limit, min_limit=1, initial=None, backoff=0.9,
+                 tolerance=2.0, alpha=0.1, baseline_alpha=0.0002,
+                 min_samples=20):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.alpha = alpha
+        self.baseline_alpha = baseline_alpha
+        self.min_samples = min_samples
+        self._limit = float(initial or min(10, max_limit))
+        self._in_flight = 0
+        self._samples = 0
+        self._latency = None
+        self._baseline = None
+        self._last_decrease = 0.0
+        self._stats = {'increases': 0, 'decreases': 0, 'errors': 0}
+        self._cond = threading.Condition()
+
+    def after_fork(self):
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait, within the current deadline, until another request may start.
+        """
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                remaining = _remaining()
+                self._cond.wait(remaining)
+            self._in_flight += 1
+
+    def release(self, latency, ok):
+        """
+        Record a finished request. ok is False for errors and responses that
+        signal overload.
+        """
+        now = time.monotonic()
+        with self._cond:
+            saturated = self._in_flight >= int(self._limit)
+            self._in_flight -= 1
+
+            if ok:
+                self._samples += 1
+                if self._latency is None:
+                    self._latency = self._baseline = latency
+                else:
+                    self._latency += self.alpha * (latency - self._latency)
+                    # The baseline follows the recent latency down at once
+                    # but up only slowly, so queueing that builds up
+                    # gradually still stands out against it.
+                    if self._latency < self._baseline:
+                        self._baseline = self._latency
+                    else:
+                        self._baseline += self.baseline_alpha * (
+                            self._latency - self._baseline)
+            else:
+                self._stats['errors'] += 1
+
+            slow = ok and self._samples >= self.min_samples and \
+                self._latency > self.tolerance * self._baseline
+            if not ok or slow:
+                if now - self._last_decrease >= (self._latency or 0):
+                    self._last_decrease = now
+                    self._limit = max(self.min_limit,
+                                      self._limit * self.backoff)
+                    self._stats['decreases'] += 1
+            elif saturated and self._limit < self.max_limit:
+                self._limit = min(self.max_limit,
+                                  self._limit + 1.0 / self._limit)
+                self._stats['increases'] += 1
+
+            self._cond.notify_all()
+
+    def cancel(self):
+        """
+        Give back the slot of a request that was never sent, without
+        recording anything about it.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, limit=int(self._limit),
+                        in_flight=self._in_flight,
+                        min_limit=self.min_limit, max_limit=self.max_limit,
+                        latency=self._latency, baseline=self._baseline)
 
 
-class APIException(LoginTCException):
+class _TransferStats(object):
     """
-    Exception for failures because of API.
+    Counts the bytes of response bodies received for each endpoint, as sent
+    on the wire and after decompression.
     """
 
-    def __init__(self, code, message):
-        LoginTCException.__init__(self, message)
+    # Path segments that are ids, replaced so that an endpoint's requests
+    # are counted together.
+    _ID = re.compile(r'/(?:[0-9a-fA-F]{40}|\d+)(?=/|$)')
 
-        self.code = code
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+    def record(self, method, path, response, content):
+        endpoint = '%s %s' % (method, self._ID.sub('/{id}',
+                                                   path.split('?')[0]))
+        size = len(content)
+        wire_size = int(response.get('-content-length', size))
+
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {
+                'requests': 0, 'compressed': 0, 'compressed_bytes': 0,
+                'uncompressed_bytes': 0})
+            stats['requests'] += 1
+            if '-content-encoding' in response:
+                stats['compressed'] += 1
+            stats['compressed_bytes'] += wire_size
+            stats['uncompressed_bytes'] += size
+
+    def stats(self):
+        with self._lock:
+            return dict((endpoint, dict(stats))
+                        for endpoint, stats in self._stats.items())
+
+
+def _iter_pages(fetch):
+    """
+    Yield every item of a paginated listing, calling fetch(page) with
+    increasing page numbers until an empty page is returned.
+    """
+    page = 1
+    while True:
+        items = fetch(page)
+        if not items:
+            return
+        for item in items:
+            yield item
+        page += 1
 
 
-class NoTokenException(APIException):
+def _run_concurrently(func, items, max_workers, rate_limit=None):
     """
-    Exception for failure because of no valid token for the specified user and
-    domain. This means the token doesn't exist, it's not yet loaded, or it has
-    been revoked.
+    Call func on every item from a pool of max_workers threads, starting at
+    most rate_limit calls per second if given.
+
+    The caller's deadline, if any, applies to every call.
+
+    Returns a list, in input order, holding each call's return value or the
+    exception it raised.
     """
+    items = list(items)
+    if not items:
+        return []
+
+    limiter = _RateLimiter(rate_limit) if rate_limit else None
+    deadline = _current_deadline()
+
+    def call(item):
+        try:
+            with _deadline(deadline=deadline):
+                if limiter is not None:
+                    limiter.wait()
+                _remaining()
+                return func(item)
+        except Exception as e:
+            return e
 
-    def __init__(self, code, message):
-        APIException.__init__(self, code, message)
+    with ThreadPoolExecutor(max_workers=min(max_workers,
+                                            len(items))) as executor:
+        return list(executor.map(call, items))
+
+
+# Clients whose per-process state is reset in the child after a fork.
+_clients = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for client in list(_clients):
+        client._check_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
 
 
 class LoginTC(object):
     """
     LoginTC Admin client to manage LoginTC users, domains, tokens and sessions.
+
+    Every API method accepts an optional timeout, in seconds, for the whole
+    call. When it runs out the call raises TimeoutException.
     """
     DEFAULT_HOST = 'cloud.logintc.com'
     CONTENT_TYPE = 'application/vnd.logintc.v1+json'
     DEFAULT_ACCEPT_HEADER = 'application/vnd.logintc.v1+json'
+    DEFAULT_MAX_WORKERS = 10
+    REFRESH_WORKERS = 4
+    MAX_PENDING_REFRESHES = 1000
+
+    def __init__(self, api_key, host=DEFAULT_HOST, secure=True, ca_certs=None,
+                 coalesce=True, cache=None, snapshot=None, timeout=None,
+                 hedge=False, hedge_percentile=95, hedge_max_ratio=0.05,
+                 health_check_interval=None, prewarm_after_fork=False,
+                 keepalive_interval=None, max_concurrency=None,
+                 http_factory=None):
+        """
+        host may be a list of hosts serving the same organization. Each
+        request is sent to the fastest healthy host, and idempotent requests
+        fail over to the next host when one errors. If health_check_interval
+        is given, every host is pinged that often from a background thread.
+
+        When coalesce is set, concurrent identical GET requests made through
+        this client share a single in-flight request and its result.
+
+        cache is an optional lookup cache backend (see logintc.cache) used by
+        get_user, get_user_by_username and get_domain. snapshot is the path of
+        an organization snapshot to warm the cache with (see load_snapshot).
+
+        timeout is the default socket timeout, in seconds, of every request.
+
+        Requests are sent from a pool of httplib2.Http instances, so settings
+        made on self.http do not reach them. To set proxy_info, credentials or
+        other httplib2 options, pass http_factory, a callable returning a new
+        httplib2.Http.
+
+        When hedge is set, a GET that has not answered within the
+        hedge_percentile of recent GET latencies is sent a second time and the
+        first answer is used. At most hedge_max_ratio of GETs are hedged.
+
+        The client can be shared with worker processes forked after it was
+        created: each child drops the inherited connections and locks on its
+        first request. With prewarm_after_fork set, a child instead opens a
+        fresh connection in the background right after the fork. Health
+        check and keep-alive threads are restarted in the child.
+
+        If keepalive_interval is given, idle pooled connections are exercised
+        that often so that they are not closed for inactivity (see warm_up).
+
+        If max_concurrency is given, the number of requests in flight through
+        this client is limited to between 1 and max_concurrency, adapting to
+        the observed latency and errors (see concurrency_stats). Bulk methods
+        can then be given as many workers as max_concurrency and settle at the
+        concurrency the API sustains.
+        """
+        if host is None:
+            host = LoginTC.DEFAULT_HOST
+
+        if isinstance(host, (list, tuple)):
+            self.hosts = list(host)
+        else:
+            self.hosts = [host]
 
-    def __init__(self, api_key, host=DEFAULT_HOST, secure=True, ca_certs=None):
         self.api_key = api_key
-        self.host = host
-        self.base_uri = 'http%s://%s' % ('s' if secure else '', host)
+        self.host = self.hosts[0]
+        self.secure = secure
+        self.base_uri = self._base_uri(self.host)
+        self._hosts = _HostSelector(self.hosts)
+        self._transfers = _TransferStats()
+        self._limiter = _AdaptiveLimiter(max_concurrency) \
+            if max_concurrency is not None else None
+
+        self.http = _ConnectionPool(ca_certs=ca_certs, timeout=timeout,
+                                    factory=http_factory)
+        self._single_flight = _SingleFlight() if coalesce else None
+        self._hedger = _Hedger(hedge_percentile, hedge_max_ratio) \
+            if hedge else None
+
+        self.cache = cache
+        # Cache keys are prefixed with a hash of the API key and hosts, so that
+        # clients of different organizations can share a cache.
+        self._cache_prefix = hashlib.blake2b(
+            '\n'.join([api_key] + sorted(self.hosts)).encode('utf-8'),
+            digest_size=8).hexdigest() + ':'
+        self._membership = {}
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+        self._refresh_queue = deque()
+        self._refresh_workers = 0
+
+        if snapshot is not None:
+            self.load_snapshot(snapshot)
+
+        self.health_check_interval = health_check_interval
+        self.keepalive_interval = keepalive_interval
+        self._start_background_threads()
+
+        self.prewarm_after_fork = prewarm_after_fork
+        self._pid = os.getpid()
+        _clients.add(self)
+
+    def _start_background_threads(self):
+        client = weakref.ref(self)
+        for loop, interval in [
+                (self._health_check_loop, self.health_check_interval),
+                (self._keepalive_loop, self.keepalive_interval)]:
+            if interval is not None:
+                thread = threading.Thread(target=loop,
+                                          args=(client, interval))
+                thread.daemon = True
+                thread.start()
+
+    def _check_fork(self):
+        """
+        Reset per-process state if this process was forked from the one that
+        last used the client.
+        """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+
+        # Connections are shared with the parent and any lock may have been
+        # held by a thread that does not exist in this process.
+        if hasattr(self.http, 'after_fork'):
+            self.http.after_fork()
+        if self._single_flight is not None:
+            self._single_flight = _SingleFlight()
+        if self._hedger is not None:
+            self._hedger.after_fork()
+        self._hosts.after_fork()
+        self._transfers.after_fork()
+        if self._limiter is not None:
+            self._limiter.after_fork()
+        if hasattr(self.cache, 'after_fork'):
+            self.cache.after_fork()
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+        self._refresh_queue = deque()
+        self._refresh_workers = 0
+        for index in self._membership.values():
+            index.after_fork()
+        self._start_background_threads()
+
+        if self.prewarm_after_fork:
+            thread = threading.Thread(target=self.warm_up)
+            thread.daemon = True
+            thread.start()
+
+    def _base_uri(self, host):
+        return 'http%s://%s' % ('s' if self.secure else '', host)
+
+    def deadline(self, timeout):
+        """
+        Context manager limiting every call made by the current thread within
+        the block to complete within timeout seconds in total.
+
+        Raises TimeoutException once the deadline has passed.
+        """
+        return _deadline(timeout)
+
+    def _http(self, method, path, body=None, accept_header=DEFAULT_ACCEPT_HEADER,
+              timeout=None):
+        """
+        Internal HTTP client for the REST API.
+        """
+        self._check_fork()
+
+        def request():
+            if method == 'GET' and self._hedger is not None:
+                return self._hedger.run(
+                    lambda: self._request(method, path, body, accept_header))
+            return self._request(method, path, body, accept_header)
 
-        if self.host is None:
-            self.host = LoginTC.DEFAULT_HOST
+        with _deadline(timeout):
+            if method == 'GET' and self._single_flight is not None:
+                return self._single_flight.do((path, accept_header), request)
 
-        self.http = httplib2.Http(ca_certs=ca_certs)
-        self.http.follow_all_redirects = True
+            return request()
 
-    def _http(self, method, path, body=None, accept_header=DEFAULT_ACCEPT_HEADER):
+    def check_hosts(self, timeout=None):
         """
-        Internal HTTP client for the REST API.
+        Ping every host and update its health and latency.
+
+        Returns a dict mapping each host to True if it answered the ping.
+        """
+        results = {}
+
+        for host in self.hosts:
+            try:
+                with _deadline(timeout):
+                    self._request('GET', '/ping', None,
+                                  self.DEFAULT_ACCEPT_HEADER, host=host,
+                                  limited=False)
+                results[host] = True
+            except Exception:
+                results[host] = False
+
+        return results
+
+    def warm_up(self, connections=1, timeout=None):
+        """
+        Open connections to every host ahead of time, so that later requests
+        do not pay for DNS resolution, the TCP connect or the TLS handshake.
+
+        connections pings are sent to each host concurrently, each on its own
+        pooled connection, which also keeps already open connections alive.
+
+        Returns the number of pings that succeeded.
+        """
+        def ping(host):
+            return self._request('GET', '/ping', None,
+                                 self.DEFAULT_ACCEPT_HEADER, host=host,
+                                 limited=False)
+
+        hosts = [host for host in self.hosts for _ in range(connections)]
+        if not hosts:
+            return 0
+
+        with _deadline(timeout):
+            results = _run_concurrently(ping, hosts, len(hosts))
+
+        return len([result for result in results
+                    if not isinstance(result, Exception)])
+
+    # The background loops only hold a weak reference to the client, and
+    # stop once it has been garbage collected.
+
+    @staticmethod
+    def _keepalive_loop(client, interval):
+        while True:
+            time.sleep(interval)
+            current = client()
+            if current is None:
+                return
+            size = current.http.size() if hasattr(current.http, 'size') else 1
+            current.warm_up(connections=max(size, 1), timeout=interval)
+            del current
+
+    @staticmethod
+    def _health_check_loop(client, interval):
+        while True:
+            time.sleep(interval)
+            current = client()
+            if current is None:
+                return
+            current.check_hosts(timeout=interval)
+            del current
+
+    def host_stats(self):
+        """
+        Get per-host health information.
+
+        Returns a dict mapping each host to a dict with its smoothed latency
+        in seconds (None until it has answered), its consecutive error count
+        and whether it is currently considered healthy.
+        """
+        return self._hosts.stats()
+
+    def concurrency_stats(self):
+        """
+        Get the state of the adaptive concurrency limiter.
+
+        Returns a dict with the current limit, the requests in flight, the
+        configured min_limit and max_limit, the recent and baseline latencies
+        in seconds, and counters of limit increases, decreases and
+        errors, or None if max_concurrency was not given.
+        """
+        if self._limiter is None:
+            return None
+        return self._limiter.stats()
+
+    def transfer_stats(self):
+        """
+        Get response size counters per endpoint.
+
+        Returns a dict mapping each endpoint, such as 'GET /api/users/{id}', to a
+        dict with its number of responses, how many of them were compressed,
+        and the total bytes of their bodies as received (compressed_bytes)
+        and once decompressed (uncompressed_bytes).
+        """
+        return self._transfers.stats()
+
+    def hedge_stats(self):
+        """
+        Get hedging counters.
+
+        Returns a dict with the number of GET requests, how many of them were
+        hedged and how many times the hedged copy answered first, or None if
+        hedging is disabled.
+        """
+        if self._hedger is None:
+            return None
+        return self._hedger.stats()
+
+    def _request(self, method, path, body, accept_header, host=None,
+                 limited=True):
         """
+        Send a request to the REST API and check its response status.
+
+        Unless a host is given, the request is sent to the best host and
+        retried on the next one if it fails and can safely be repeated.
+        Unless limited is False, the request goes through the adaptive
+        concurrency limiter, if any.
+        """
+        limiter = self._limiter if limited else None
         path = '%s%s' % ('/api', path)
 
         headers = {'Accept': accept_header,
@@ -86,9 +1183,71 @@ class LoginTC(object):
             else:
                 headers['Content-Length'] = '0'
 
-        response, content = self.http.request('%s%s' % (self.base_uri, path),
-                                              method,
-                                              headers=headers, body=body)
+        idempotent = method in ['GET', 'PUT', 'DELETE']
+        tried = []
+
+        while True:
+            current = host or self._hosts.choose(tried)
+            tried.append(current)
+            can_retry = host is None and self._hosts.choose(tried) is not None
+
+            if limiter is not None:
+                limiter.acquire()
+
+            start = time.monotonic()
+            try:
+                kwargs = {}
+                remaining = _remaining()
+                if remaining is not None:
+                    kwargs['timeout'] = remaining
+
+                response, content = self.http.request(
+                    '%s%s' % (self._base_uri(current), path), method,
+                    headers=headers, body=body, **kwargs)
+            except socket.timeout:
+                # An attempt abandoned for its hedge is not a host failure.
+                abandoned = _attempt_abandoned()
+                self._release(limiter, start, abandoned)
+                if abandoned:
+                    raise
+                self._hosts.failure(current)
+                if can_retry and idempotent:
+                    continue
+                raise TimeoutException()
+            except (socket.error, httplib2.HttpLib2Error) as e:
+                abandoned = _attempt_abandoned()
+                self._release(limiter, start, abandoned)
+                if abandoned:
+                    raise
+                self._hosts.failure(current)
+                # Requests that never reached the host are always safe to
+                # send again.
+                unsent = isinstance(e, (ConnectionRefusedError,
+                                        httplib2.ServerNotFoundError))
+                if can_retry and (idempotent or unsent):
+                    continue
+                raise
+            except TimeoutException:
+                # The caller's deadline passed before the request was sent,
+                # which says nothing about the API.
+                if limiter is not None:
+                    limiter.cancel()
+                raise
+            except Exception:
+                self._release(limiter, start, False)
+                raise
+
+            status = int(response['status'])
+            self._release(limiter, start, status != 429 and status < 500)
+            if status >= 500:
+                self._hosts.failure(current)
+                if can_retry and idempotent:
+                    continue
+            else:
+                self._hosts.success(current, time.monotonic() - start)
+            break
+
+        self._transfers.record(method, path, response, content)
 
         if str(response['status']) not in ['200', '201', '202']:
             error_json = None
@@ -114,41 +1273,195 @@ class LoginTC(object):
 
         return content
 
-    def get_user(self, user_id):
+    @staticmethod
+    def _release(limiter, start, ok):
+        if limiter is not None:
+            limiter.release(time.monotonic() - start, ok)
+
+    def _cached_get(self, key, path, timeout=None):
+        """
+        GET path through the lookup cache, if any. Stale entries are returned
+        as is and refreshed in the background.
+        """
+        if self.cache is None:
+            return self._http('GET', path, timeout=timeout)
+
+        key = self._cache_prefix + key
+        entry = self.cache.get(key)
+        if entry is not None:
+            content, stale = entry
+            if stale:
+                self._refresh_cached(key, path)
+            return content
+
+        content = self._http('GET', path, timeout=timeout)
+        self.cache.set(key, content)
+        return content
+
+    def _refresh_cached(self, key, path):
+        """
+        Queue a stale cache entry to be refreshed by up to REFRESH_WORKERS
+        background threads. Once MAX_PENDING_REFRESHES are queued, further
+        stale entries are served as is and refreshed on a later lookup.
+        """
+        with self._refreshing_lock:
+            if key in self._refreshing or \
+                    len(self._refreshing) >= self.MAX_PENDING_REFRESHES:
+                return
+            self._refreshing.add(key)
+            self._refresh_queue.append((key, path))
+
+            if self._refresh_workers >= self.REFRESH_WORKERS:
+                return
+            self._refresh_workers += 1
+
+        thread = threading.Thread(target=self._refresh_worker,
+                                  args=(weakref.ref(self),))
+        thread.daemon = True
+        thread.start()
+
+    @staticmethod
+    def _refresh_worker(client):
+        # Workers exit once the queue is empty, and hold the client weakly
+        # between entries.
+        while True:
+            current = client()
+            if current is None:
+                return
+            with current._refreshing_lock:
+                if not current._refresh_queue:
+                    current._refresh_workers -= 1
+                    return
+                key, path = current._refresh_queue.popleft()
+
+            try:
+                current.cache.set(key, current._http('GET', path))
+            except APIException:
+                current.cache.delete(key)
+            except Exception:
+                # Keep serving the stale entry until the next attempt.
+                pass
+            finally:
+                with current._refreshing_lock:
+                    current._refreshing.discard(key)
+            del current
+
+    def _invalidate_user(self, user_id):
+        if self.cache is None:
+            return
+
+        key = '%suser:%s' % (self._cache_prefix, user_id)
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.cache.delete('%susername:%s' % (
+                self._cache_prefix, json.loads(entry[0])['username']))
+        self.cache.delete(key)
+
+    def load_snapshot(self, path):
+        """
+        Warm the lookup cache with the users and domains of a snapshot written
+        by logintc.export, creating a MemoryCache if the client has no cache.
+
+        Entries are dated by the snapshot file's modification time, so those
+        older than the cache TTL are served stale on first use and refreshed
+        in the background.
+
+        A snapshot is only loaded once into a cache: with a SharedCache, the
+        first process on the host to load it fills the cache for the others.
+
+        Returns the number of cache entries loaded.
+        """
+        from logintc.export import read_snapshot
+
+        if self.cache is None:
+            self.cache = MemoryCache()
+
+        fetched = os.path.getmtime(path)
+        loaded = 0
+        prefix = self._cache_prefix
+
+        marker = '%ssnapshot:%s:%r' % (prefix, os.path.abspath(path), fetched)
+        if self.cache.get(marker) is not None:
+            return 0
+
+        for record in read_snapshot(path):
+            data = record.get('data')
+            if record['type'] == 'user':
+                content = json.dumps(data)
+                self.cache.set('%suser:%s' % (prefix, data['id']), content,
+                               fetched)
+                self.cache.set('%susername:%s' % (prefix, data['username']),
+                               content, fetched)
+                loaded += 2
+            elif record['type'] == 'domain':
+                self.cache.set('%sdomain:%s' % (prefix, data['id']),
+                               json.dumps(data), fetched)
+                loaded += 1
+
+        self.cache.set(marker, '{}', fetched)
+        return loaded
+
+    def get_user(self, user_id, timeout=None):
         """
         Get user info.
 
         Returns a dict containing the user's information.
         """
-        return json.loads(self._http('GET', '/users/%s' % user_id))
+        return json.loads(self._cached_get('user:%s' % user_id,
+                                           '/users/%s' % user_id,
+                                           timeout=timeout))
 
-    def get_user_by_username(self, username):
+    def get_user_by_username(self, username, timeout=None):
         """
         Get user info.
 
         Returns a dict containing the user's information.
         """
-        return json.loads(self._http('GET', '/users?username=%s' % username))
+        return json.loads(self._cached_get('username:%s' % username,
+                                           '/users?username=%s' % username,
+                                           timeout=timeout))
+
+    def get_users_by_ids(self, user_ids, max_workers=DEFAULT_MAX_WORKERS,
+                         timeout=None):
+        """
+        Get the info of many users concurrently, with at most max_workers
+        requests in flight. timeout bounds the whole call.
+
+        Returns a list, in the order of user_ids, holding each user's
+        information dict or the LoginTCException raised for that user.
+        """
+        with _deadline(timeout):
+            return _run_concurrently(self.get_user, user_ids, max_workers)
 
-    def get_users(self, page=1):
+    def get_users(self, page=1, timeout=None):
         """
         Get users info.
 
         Returns a dict containing the user's information.
         """
-        return json.loads(self._http('GET', '/users?page=%d' % page))
+        return json.loads(self._http('GET', '/users?page=%d' % page,
+                                     timeout=timeout))
+
+    def iter_users(self):
+        """
+        Iterate over all of the organization's users, fetching pages as needed.
+
+        Returns a generator of dicts containing each user's information.
+        """
+        return _iter_pages(self.get_users)
 
 
-    def create_user(self, username, email, name):
+    def create_user(self, username, email, name, timeout=None):
         """
         Create a new user.
 
         Returns the information for the new user as a dict.
         """
         body = {'username': username, 'email': email, 'name': name}
-        return json.loads(self._http('POST', '/users', json.dumps(body)))
+        return json.loads(self._http('POST', '/users', json.dumps(body),
+                                     timeout=timeout))
 
-    def update_user(self, user_id, email=None, name=None):
+    def update_user(self, user_id, email=None, name=None, timeout=None):
         """
         Update a user's name and/or email. Updating the username is not
         permitted.
@@ -163,26 +1476,33 @@ class LoginTC(object):
         if name is not None:
             body['name'] = name
 
-        return json.loads(self._http('PUT', '/users/%s' % user_id,
-                                     json.dumps(body)))
+        content = self._http('PUT', '/users/%s' % user_id, json.dumps(body),
+                             timeout=timeout)
+        self._invalidate_user(user_id)
+        return json.loads(content)
 
-    def delete_user(self, user_id):
+    def delete_user(self, user_id, timeout=None):
         """
         Delete a user.
 
         No return value.
         """
-        self._http('DELETE', '/users/%s' % user_id)
+        self._http('DELETE', '/users/%s' % user_id, timeout=timeout)
+        self._invalidate_user(user_id)
 
-    def add_domain_user(self, domain_id, user_id):
+    def add_domain_user(self, domain_id, user_id, timeout=None):
         """
         Add a user to a domain.
 
         No return value.
         """
-        self._http('PUT', '/domains/%s/users/%s' % (domain_id, user_id))
+        self._http('PUT', '/domains/%s/users/%s' % (domain_id, user_id),
+                   timeout=timeout)
+        self._invalidate_user(user_id)
+        if domain_id in self._membership:
+            self._membership[domain_id].add(user_id)
 
-    def set_domain_users(self, domain_id, users):
+    def set_domain_users(self, domain_id, users, timeout=None):
         """
         Set a domain's users.
 
@@ -197,18 +1517,28 @@ class LoginTC(object):
 
         No return value.
         """
-        self._http('PUT', '/domains/%s/users' % domain_id, json.dumps(users))
+        self._http('PUT', '/domains/%s/users' % domain_id, json.dumps(users),
+                   timeout=timeout)
+        if self.cache is not None:
+            self.cache.clear(self._cache_prefix)
+        if domain_id in self._membership:
+            # Users are given by username, so the new member ids are unknown.
+            self._membership[domain_id].refresh_in_background()
 
-    def remove_domain_user(self, domain_id, user_id):
+    def remove_domain_user(self, domain_id, user_id, timeout=None):
         """
         Remove a user from a domain, revoke their token, and remove any pending
         confirmation codes.
 
         No return value.
         """
-        self._http('DELETE', '/domains/%s/users/%s' % (domain_id, user_id))
+        self._http('DELETE', '/domains/%s/users/%s' % (domain_id, user_id),
+                   timeout=timeout)
+        self._invalidate_user(user_id)
+        if domain_id in self._membership:
+            self._membership[domain_id].discard(user_id)
 
-    def create_user_token(self, domain_id, user_id):
+    def create_user_token(self, domain_id, user_id, timeout=None):
         """
         Create a user token if one does not exist or if it has been revoked.
         Does nothing if the token is already active or not yet loaded.
@@ -216,9 +1546,10 @@ class LoginTC(object):
         Returns a dict containing the token information.
         """
         return json.loads(self._http('PUT',
-                                     '/domains/%s/users/%s/token' % (domain_id, user_id)))
+                                     '/domains/%s/users/%s/token' % (domain_id, user_id),
+                                     timeout=timeout))
 
-    def get_user_token(self, domain_id, user_id):
+    def get_user_token(self, domain_id, user_id, timeout=None):
         """
         Gets a user's token information.
 
@@ -227,19 +1558,37 @@ class LoginTC(object):
         Returns a dict containing the token information.
         """
         return json.loads(self._http('GET',
-                                     '/domains/%s/users/%s/token' % (domain_id, user_id)))
+                                     '/domains/%s/users/%s/token' % (domain_id, user_id),
+                                     timeout=timeout))
 
-    def delete_user_token(self, domain_id, user_id):
+    def get_user_tokens(self, domain_id, user_ids,
+                        max_workers=DEFAULT_MAX_WORKERS, timeout=None):
+        """
+        Get the token information of many users of a domain concurrently, with
+        at most max_workers requests in flight. timeout bounds the whole call.
+
+        Returns a list, in the order of user_ids, holding each user's token
+        information dict or the LoginTCException raised for that user, such as
+        NoTokenException.
+        """
+        with _deadline(timeout):
+            return _run_concurrently(
+                lambda user_id: self.get_user_token(domain_id, user_id),
+                user_ids, max_workers)
+
+    def delete_user_token(self, domain_id, user_id, timeout=None):
         """
         Delete (i.e. revoke) a user's token.
 
         No return value.
         """
         self._http('DELETE',
-                   '/domains/%s/users/%s/token' % (domain_id, user_id))
+                   '/domains/%s/users/%s/token' % (domain_id, user_id),
+                   timeout=timeout)
 
     def create_session(self, domain_id, user_id=None, attributes=None,
-                       username=None, ip_address=None, bypass_code=None, otp=None):
+                       username=None, ip_address=None, bypass_code=None, otp=None,
+                       timeout=None):
         """
         Create a LoginTC request.
 
@@ -266,145 +1615,284 @@ class LoginTC(object):
             body['otp'] = otp
 
         resp = self._http('POST', '/domains/%s/sessions' % domain_id,
-                          json.dumps(body))
+                          json.dumps(body), timeout=timeout)
 
         return json.loads(resp)
 
-    def get_session(self, domain_id, session_id):
+    def get_session(self, domain_id, session_id, timeout=None):
         """
         Get a session's information.
 
         Returns a dict containing an id and state for the session.
         """
         resp = self._http('GET', '/domains/%s/sessions/%s' %
-                          (domain_id, session_id))
+                          (domain_id, session_id), timeout=timeout)
 
         return json.loads(resp)
 
-    def delete_session(self, domain_id, session_id):
+    def delete_session(self, domain_id, session_id, timeout=None):
         """
         Delete (i.e. cancel) a session.
 
         No return value.
         """
         self._http('DELETE',
-                   '/domains/%s/sessions/%s' % (domain_id, session_id))
+                   '/domains/%s/sessions/%s' % (domain_id, session_id),
+                   timeout=timeout)
 
-    def get_ping(self):
+    def get_ping(self, timeout=None):
         """
         Get ping status.
 
         Returns a dict containing the ping status.
         """
-        return json.loads(self._http('GET', '/ping'))
+        return json.loads(self._http('GET', '/ping', timeout=timeout))
 
-    def get_organization(self):
+    def get_organization(self, timeout=None):
         """
         Get organization info.
 
         Returns a dict containing the organization information.
         """
-        return json.loads(self._http('GET', '/organization'))
+        return json.loads(self._http('GET', '/organization', timeout=timeout))
 
-    def get_domain(self, domain_id):
+    def get_domain(self, domain_id, timeout=None):
         """
         Get domain info.
 
         Returns a dict containing the domain's information.
         """
-        return json.loads(self._http('GET', '/domains/%s' % domain_id))
+        return json.loads(self._cached_get('domain:%s' % domain_id,
+                                           '/domains/%s' % domain_id,
+                                           timeout=timeout))
 
-    def get_domain_image(self, domain_id):
+    def get_domain_image(self, domain_id, timeout=None):
         """
         Get domain image.
 
         Returns a byte array containing the domain's image.
         """
-        return self._http('GET', '/domains/%s/image' % domain_id, accept_header='image/png')
+        return self._http('GET', '/domains/%s/image' % domain_id, accept_header='image/png',
+                          timeout=timeout)
 
-    def get_domain_user(self, domain_id, user_id):
+    def get_domain_user(self, domain_id, user_id, timeout=None):
         """
         Get domain user.
 
         Returns a dict containing the domain's user with given user_id.
         """
-        return json.loads(self._http('GET', '/domains/%s/users/%s' % (domain_id, user_id)))
+        return json.loads(self._http('GET', '/domains/%s/users/%s' % (domain_id, user_id),
+                                     timeout=timeout))
 
-    def get_domain_users(self, domain_id, page=1):
+    def get_domain_users(self, domain_id, page=1, timeout=None):
         """
         Get domain users.
 
         Returns a dict containing an array of domain's users.
         """
-        return json.loads(self._http('GET', '/domains/%s/users?page=%d' % (domain_id, page)))
+        return json.loads(self._http('GET', '/domains/%s/users?page=%d' % (domain_id, page),
+                                     timeout=timeout))
+
+    def index_domain(self, domain_id, refresh_interval=None):
+        """
+        Build an in-memory index of a domain's members, used by
+        is_domain_user. The index is kept up to date by this client's
+        add_domain_user, remove_domain_user and set_domain_users calls and,
+        if refresh_interval is given, rebuilt that often in the background.
+
+        Returns the logintc.membership.MembershipIndex.
+        """
+        index = MembershipIndex(self, domain_id, refresh_interval)
+        index.refresh()
+        index.start()
+
+        previous = self._membership.get(domain_id)
+        self._membership[domain_id] = index
+        if previous is not None:
+            previous.stop()
+
+        return index
+
+    def is_domain_user(self, domain_id, user_id, timeout=None):
+        """
+        Check whether a user is a member of a domain. Indexed domains (see
+        index_domain) are answered locally; others with get_domain_user.
+
+        Returns True or False.
+        """
+        index = self._membership.get(domain_id)
+        if index is not None:
+            return user_id in index
 
+        try:
+            self.get_domain_user(domain_id, user_id, timeout=timeout)
+        except APIException as e:
+            if e.code.startswith('api.error.notfound'):
+                return False
+            raise
+        return True
 
-    def get_bypass_code(self, bypass_code_id):
+    def iter_domain_users(self, domain_id):
+        """
+        Iterate over all of a domain's users, fetching pages as needed.
+
+        Returns a generator of dicts containing each user's information.
+        """
+        return _iter_pages(lambda page: self.get_domain_users(domain_id, page))
+
+
+    def get_bypass_code(self, bypass_code_id, timeout=None):
         """
         Get bypass code.
 
         Returns a dict containing the bypass code's information.
         """
-        return json.loads(self._http('GET', '/bypasscodes/%s' % bypass_code_id))
+        return json.loads(self._http('GET', '/bypasscodes/%s' % bypass_code_id,
+                                     timeout=timeout))
 
-    def get_bypass_codes(self, user_id):
+    def get_bypass_codes(self, user_id, timeout=None):
         """
         Get bypass code.
 
         Returns a dict containing an array of the user's bypass code information.
         """
-        return json.loads(self._http('GET', '/users/%s/bypasscodes' % user_id))
+        return json.loads(self._http('GET', '/users/%s/bypasscodes' % user_id,
+                                     timeout=timeout))
 
-    def create_bypass_code(self, user_id, uses_allowed = 1, expiration_time = 0):
+    def create_bypass_code(self, user_id, uses_allowed = 1, expiration_time = 0,
+                           timeout=None):
         """
         Create a bypass code.
 
         Returns the information for the bypass code as a dict.
         """
         body = {'usesAllowed': uses_allowed, 'expirationTime': expiration_time}
-        return json.loads(self._http('POST', '/users/%s/bypasscodes' % user_id, json.dumps(body)))
+        return json.loads(self._http('POST', '/users/%s/bypasscodes' % user_id, json.dumps(body),
+                                     timeout=timeout))
 
-    def delete_bypass_code(self, bypass_code_id):
+    def delete_bypass_code(self, bypass_code_id, timeout=None):
         """
         Delete a bypass code.
 
         No return value.
         """
-        self._http('DELETE', '/bypasscodes/%s' % bypass_code_id)
+        self._http('DELETE', '/bypasscodes/%s' % bypass_code_id,
+                   timeout=timeout)
 
-    def delete_bypass_codes(self, user_id):
+    def delete_bypass_codes(self, user_id, timeout=None):
         """
         Delete all of user's bypass codes.
 
         No return value.
         """
-        self._http('DELETE', '/users/%s/bypasscodes' % user_id)
+        self._http('DELETE', '/users/%s/bypasscodes' % user_id,
+                   timeout=timeout)
+
+    def _bulk_user_ids(self, user_ids, domain_id):
+        if (user_ids is None) == (domain_id is None):
+            raise ValueError('Specify exactly one of user_ids or domain_id.')
+
+        if domain_id is not None:
+            return [user['id'] for user in self.iter_domain_users(domain_id)]
+
+        return list(user_ids)
+
+    def bulk_create_bypass_codes(self, user_ids=None, domain_id=None,
+                                 uses_allowed=1, expiration_time=0,
+                                 max_workers=DEFAULT_MAX_WORKERS,
+                                 rate_limit=None, timeout=None):
+        """
+        Create a bypass code for each of many users concurrently.
+
+        Either pass a list of user_ids, or a domain_id to create a bypass code
+        for every user in that domain. At most max_workers requests are in
+        flight at once and, if rate_limit is given, at most rate_limit
+        requests are started per second. timeout bounds the whole call; users
+        not reached in time get a TimeoutException.
+
+        Returns a dict mapping each user id to the bypass code information
+        dict, or to the LoginTCException raised for that user.
+        """
+        with _deadline(timeout):
+            user_ids = self._bulk_user_ids(user_ids, domain_id)
+            results = _run_concurrently(
+                lambda user_id: self.create_bypass_code(user_id, uses_allowed,
+                                                        expiration_time),
+                user_ids, max_workers, rate_limit)
+
+        return dict(zip(user_ids, results))
+
+    def bulk_delete_bypass_codes(self, user_ids=None, domain_id=None,
+                                 max_workers=DEFAULT_MAX_WORKERS,
+                                 rate_limit=None, timeout=None):
+        """
+        Delete all bypass codes of each of many users concurrently.
+
+        Takes either user_ids or domain_id, and the same concurrency options
+        as bulk_create_bypass_codes.
+
+        Returns a dict mapping each user id to None on success, or to the
+        LoginTCException raised for that user.
+        """
+        with _deadline(timeout):
+            user_ids = self._bulk_user_ids(user_ids, domain_id)
+            results = _run_concurrently(self.delete_bypass_codes, user_ids,
+                                        max_workers, rate_limit)
+
+        return dict(zip(user_ids, results))
     
-    def get_hardware_token(self, hardware_token_id):
+    def get_hardware_token(self, hardware_token_id, timeout=None):
         """
         Get hardware token.
 
         Returns a dict containing the hardware tokens's information.
         """
-        return json.loads(self._http('GET', '/hardware/%s' % hardware_token_id))
+        return json.loads(self._http('GET', '/hardware/%s' % hardware_token_id,
+                                     timeout=timeout))
 
-    def get_user_hardware_token(self, user_id):
+    def get_user_hardware_token(self, user_id, timeout=None):
         """
         Get user hardware token.
 
         Returns a dict containing the hardware tokens's information.
         """
-        return json.loads(self._http('GET', '/users/%s/hardware' % user_id))
+        return json.loads(self._http('GET', '/users/%s/hardware' % user_id,
+                                     timeout=timeout))
+
+    def get_user_hardware_tokens(self, user_ids,
+                                 max_workers=DEFAULT_MAX_WORKERS, timeout=None):
+        """
+        Get the hardware tokens of many users concurrently, with at most
+        max_workers requests in flight. timeout bounds the whole call.
+
+        Returns a list, in the order of user_ids, holding each user's hardware
+        token information dict or the LoginTCException raised for that user.
+        """
+        with _deadline(timeout):
+            return _run_concurrently(self.get_user_hardware_token, user_ids,
+                                     max_workers)
 
-    def get_hardware_tokens(self, page=1):
+    def get_hardware_tokens(self, page=1, timeout=None):
         """
         Get hardware token.
 
         Returns a dict containing an array of the hardware token information.
         """
-        return json.loads(self._http('GET', '/hardware?page=%d' % page))
+        return json.loads(self._http('GET', '/hardware?page=%d' % page,
+                                     timeout=timeout))
+
+    def iter_hardware_tokens(self):
+        """
+        Iterate over all of the organization's hardware tokens, fetching pages
+        as needed.
+
+        Returns a generator of dicts containing each hardware token's
+        information.
+        """
+        return _iter_pages(self.get_hardware_tokens)
 
-    def create_hardware_token(self, alias, serialNumber, type, timeStep, seed):
+    def create_hardware_token(self, alias, serialNumber, type, timeStep, seed,
+                              timeout=None):
         """
         Create a hardware token.
 
@@ -415,9 +1903,11 @@ class LoginTC(object):
         if alias is not None:
             body['alias'] = alias
         
-        return json.loads(self._http('POST', '/hardware', json.dumps(body)))
+        return json.loads(self._http('POST', '/hardware', json.dumps(body),
+                                     timeout=timeout))
 
-    def update_hardware_token(self, hardware_token_id, alias=None):
+    def update_hardware_token(self, hardware_token_id, alias=None,
+                              timeout=None):
         """
         Update a hardware token's alias.
 
@@ -429,29 +1919,32 @@ class LoginTC(object):
             body['alias'] = alias
 
         return json.loads(self._http('PUT', '/hardware/%s' % hardware_token_id,
-                                     json.dumps(body)))
+                                     json.dumps(body), timeout=timeout))
 
-    def delete_hardware_token(self, hardware_token_id):
+    def delete_hardware_token(self, hardware_token_id, timeout=None):
         """
         Delete a hardware token.
 
         No return value.
         """
-        self._http('DELETE', '/hardware/%s' % hardware_token_id)
+        self._http('DELETE', '/hardware/%s' % hardware_token_id,
+                   timeout=timeout)
         
-    def associate_hardware_token(self, user_id, hardware_token_id):
+    def associate_hardware_token(self, user_id, hardware_token_id,
+                                 timeout=None):
         """
         Associate a hardware token with a user.
 
         No return value.
         """
 
-        self._http('PUT', '/users/%s/hardware/%s' % (user_id, hardware_token_id))
+        self._http('PUT', '/users/%s/hardware/%s' % (user_id, hardware_token_id),
+                   timeout=timeout)
 
-    def disassociate_hardware_token(self, user_id):
+    def disassociate_hardware_token(self, user_id, timeout=None):
         """
         Disassociate a user's hardware token.
 
         No return value.
         """
-        self._http('DELETE', '/users/%s/hardware' % user_id)
+        self._http('DELETE', '/users/%s/hardware' % user_id, timeout=timeout)
@@ -0,0 +1,199 @@
+"""
+Admission queue for session creation.
+
+When many authentications arrive at once, for example from a RADIUS
+front-end during a VPN reconnect storm, calling create_session from every
+incoming thread ties up one thread per pending request. A SessionDispatcher
+instead accepts requests into a bounded priority queue served by a fixed
+pool of workers, and turns excess load away with OverloadedException::
+
+    dispatcher = SessionDispatcher(client, workers=20, max_queue=500)
+    future = dispatcher.submit(domain_id, username='jdoe', timeout=10)
+    session = future.result()
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from logintc.client import _deadline, _remaining
+from logintc.exceptions import OverloadedException
+
+
+class _Request(object):
+
+    def __init__(self, priority, seq, kwargs, deadline):
+        self.priority = priority
+        self.seq = seq
+        self.kwargs = kwargs
+        self.deadline = deadline
+        self.queued = time.monotonic()
+        self.future = Future()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class SessionDispatcher(object):
+    """
+    Creates sessions through client from a pool of worker threads, serving
+    queued requests in priority order.
+
+    At most max_queue requests wait in the queue. When it is full, a new
+    request is rejected with OverloadedException, unless shed is set and the
+    new request has a lower priority number than the last queued one, in
+    which case that one is failed with OverloadedException instead.
+    """
+
+    def __init__(self, client, workers=10, max_queue=1000, shed=True,
+                 window=1000):
+        self.client = client
+        self.workers = workers
+        self.max_queue = max_queue
+        self.shed = shed
+        self._queue = []
+        self._seq = itertools.count()
+        self._waits = deque(maxlen=window)
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0,
+                       'rejected': 0, 'shed': 0, 'expired': 0}
+        self._active = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self._threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, domain_id, user_id=None, attributes=None, username=None,
+               ip_address=None, bypass_code=None, otp=None, priority=0,
+               timeout=None):
+        """
+        Queue a create_session request. Requests with a lower priority number
+        are served first. timeout, in seconds, covers both the time spent in
+        the queue and the request itself; a request still queued when it
+        runs out fails with TimeoutException without being sent.
+
+        Returns a concurrent.futures.Future of the create_session result.
+        Raises OverloadedException if the queue is full.
+        """
+        kwargs = {'domain_id': domain_id, 'user_id': user_id,
+                  'attributes': attributes, 'username': username,
+                  'ip_address': ip_address, 'bypass_code': bypass_code,
+                  'otp': otp}
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        shed = None
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('The dispatcher is closed.')
+
+            request = _Request(priority, next(self._seq), kwargs, deadline)
+
+            if len(self._queue) >= self.max_queue:
+                last = max(self._queue) if self._queue else None
+                if not self.shed or last is None or not request < last:
+                    self._stats['rejected'] += 1
+                    raise OverloadedException()
+                self._queue.remove(last)
+                heapq.heapify(self._queue)
+                self._stats['shed'] += 1
+                shed = last
+
+            heapq.heappush(self._queue, request)
+            self._stats['submitted'] += 1
+            self._cond.notify()
+
+        if shed is not None:
+            shed.future.set_exception(OverloadedException())
+
+        return request.future
+
+    def create_session(self, domain_id, priority=0, timeout=None, **kwargs):
+        """
+        Queue a create_session request and wait for its result.
+        """
+        return self.submit(domain_id, priority=priority, timeout=timeout,
+                           **kwargs).result()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                request = heapq.heappop(self._queue)
+                self._waits.append(time.monotonic() - request.queued)
+                self._active += 1
+
+            try:
+                self._run(request)
+            finally:
+                with self._cond:
+                    self._active -= 1
+
+    def _run(self, request):
+        if not request.future.set_running_or_notify_cancel():
+            return
+
+        try:
+            with _deadline(deadline=request.deadline):
+                try:
+                    _remaining()
+                except Exception:
+                    with self._cond:
+                        self._stats['expired'] += 1
+                    raise
+                result = self.client.create_session(**request.kwargs)
+        except Exception as e:
+            with self._cond:
+                self._stats['failed'] += 1
+            request.future.set_exception(e)
+        else:
+            with self._cond:
+                self._stats['completed'] += 1
+            request.future.set_result(result)
+
+    def stats(self):
+        """
+        Get queue statistics.
+
+        Returns a dict with the current queue depth and number of busy
+        workers, counters of submitted, completed, failed, rejected, shed and
+        expired requests, and the mean, 95th percentile and maximum time in
+        seconds that recent requests waited in the queue.
+        """
+        with self._cond:
+            stats = dict(self._stats, queued=len(self._queue),
+                         active=self._active, workers=self.workers,
+                         max_queue=self.max_queue)
+            waits = sorted(self._waits)
+
+        if waits:
+            stats['wait_time'] = {
+                'mean': sum(waits) / len(waits),
+                'p95': waits[min(len(waits) - 1, int(len(waits) * 0.95))],
+                'max': waits[-1]}
+        else:
+            stats['wait_time'] = {'mean': None, 'p95': None, 'max': None}
+
+        return stats
+
+    def close(self, wait=True):
+        """
+        Stop accepting requests. Queued requests are still processed; if
+        wait is set, return once they are done.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
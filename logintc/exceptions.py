@@ -0,0 +1,64 @@
+"""
+Exceptions raised by the LoginTC client.
+
+This module has no dependencies, so tools that only need to catch LoginTC
+errors can import it without loading the HTTP transport.
+"""
+
+
+class LoginTCException(Exception):
+    """
+    A generic LoginTC client exception.
+    """
+    pass
+
+
+class InternalAPIException(LoginTCException):
+    """
+    Exception caused by internal client exception.
+    """
+
+    def __init__(self):
+        LoginTCException.__init__(
+            self, 'Something went wrong. Please try again.')
+
+
+class APIException(LoginTCException):
+    """
+    Exception for failures because of API.
+    """
+
+    def __init__(self, code, message):
+        LoginTCException.__init__(self, message)
+
+        self.code = code
+
+
+class TimeoutException(LoginTCException):
+    """
+    Exception for calls that did not complete within their timeout.
+    """
+
+    def __init__(self):
+        LoginTCException.__init__(self, 'The request timed out.')
+
+
+class OverloadedException(LoginTCException):
+    """
+    Exception for requests turned away because too many are already queued.
+    """
+
+    def __init__(self):
+        LoginTCException.__init__(
+            self, 'Too many requests are queued. Please try again later.')
+
+
+class NoTokenException(APIException):
+    """
+    Exception for failure because of no valid token for the specified user and
+    domain. This means the token doesn't exist, it's not yet loaded, or it has
+    been revoked.
+    """
+
+    def __init__(self, code, message):
+        APIException.__init__(self, code, message)
@@ -0,0 +1,291 @@
+"""
+Streaming export of a LoginTC organization to a snapshot file.
+
+A snapshot holds the organization's users, hardware tokens and, for the
+requested domains, the domains themselves, their memberships and user
+tokens. Pages are fetched concurrently and written as they arrive, so memory
+use does not grow with the size of the organization.
+
+The default format is gzip-compressed JSON Lines. Every line is a record of
+the form::
+
+    {"type": "user", "data": {...}}
+    {"type": "hardware_token", "data": {...}}
+    {"type": "domain", "data": {...}}
+    {"type": "domain_user", "domain_id": "...", "user_id": "..."}
+    {"type": "user_token", "domain_id": "...", "user_id": "...", "data": {...}}
+
+Each batch of records is written as its own gzip member and followed by a
+checkpoint, so an interrupted JSON Lines export can be resumed. Snapshots
+can be read back with read_snapshot(), or loaded into a client's lookup
+cache with LoginTC.load_snapshot().
+
+A columnar format ('parquet', one file per record type in a directory) is
+available when pyarrow is installed.
+"""
+
+import gzip
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from logintc.client import NoTokenException, _run_concurrently
+
+FORMATS = ('jsonl', 'parquet')
+
+
+def _iter_page_batches(fetch, start_page, max_workers):
+    """
+    Fetch pages max_workers at a time and yield (page, items) in page order
+    until the first empty page.
+    """
+    page = start_page
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            numbers = range(page, page + max_workers)
+            for number, items in zip(numbers, executor.map(fetch, numbers)):
+                if not items:
+                    return
+                yield number, items
+            page += max_workers
+
+
+class _JSONLWriter(object):
+
+    def __init__(self, path, offset):
+        self.path = path
+        with open(path, 'ab') as f:
+            f.truncate(offset)
+
+    def write(self, records):
+        """
+        Append records as a new gzip member. Returns the new file size.
+        """
+        with open(self.path, 'ab') as f:
+            with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                for record in records:
+                    gz.write(json.dumps(record, sort_keys=True).encode('utf-8'))
+                    gz.write(b'\n')
+            return f.tell()
+
+    def close(self):
+        pass
+
+
+class _ParquetWriter(object):
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('The parquet format requires pyarrow: '
+                              'pip install logintc[parquet]')
+
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = path
+        self._writers = {}
+        self._columns = {}
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    @staticmethod
+    def _flatten(record):
+        row = dict(record.get('data', {}))
+        for key in ('domain_id', 'user_id'):
+            if key in record:
+                row[key] = record[key]
+        return dict((key, value if isinstance(value, str) or value is None
+                     else json.dumps(value, sort_keys=True))
+                    for key, value in row.items())
+
+    def write(self, records):
+        rows = {}
+        for record in records:
+            rows.setdefault(record['type'], []).append(self._flatten(record))
+
+        for record_type, flat in rows.items():
+            if record_type not in self._writers:
+                # The first batch fixes the columns; fields that only show up
+                # later are kept as JSON in the _extra column.
+                columns = sorted(set().union(*flat))
+                self._columns[record_type] = columns
+                schema = self._pa.schema(
+                    [(column, self._pa.string())
+                     for column in columns + ['_extra']])
+                self._writers[record_type] = self._pq.ParquetWriter(
+                    os.path.join(self.path, '%s.parquet' % record_type),
+                    schema, compression='zstd')
+
+            columns = self._columns[record_type]
+            data = dict((column, [row.get(column) for row in flat])
+                        for column in columns)
+            data['_extra'] = [
+                json.dumps(dict((key, value) for key, value in row.items()
+                                if key not in columns), sort_keys=True)
+                if set(row) - set(columns) else None
+                for row in flat]
+            self._writers[record_type].write_table(
+                self._pa.table(data, schema=self._writers[record_type].schema))
+
+        return 0
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+
+
+class Exporter(object):
+    """
+    Exports an organization snapshot to path.
+
+    Domain memberships (and, when tokens is set, user tokens) are exported
+    for the given domain_ids. Up to max_workers pages or token lookups are
+    fetched at once.
+    """
+
+    def __init__(self, client, path, domain_ids=(), tokens=True,
+                 format='jsonl', max_workers=4):
+        if format not in FORMATS:
+            raise ValueError('Unknown snapshot format: %s' % format)
+
+        self.client = client
+        self.path = path
+        self.domain_ids = list(domain_ids)
+        self.tokens = tokens
+        self.format = format
+        self.max_workers = max_workers
+        self.state_path = '%s.state' % path
+
+    def _sections(self):
+        sections = [('users', self.client.get_users, None),
+                    ('hardware_tokens', self.client.get_hardware_tokens, None),
+                    ('domains', self._domains_fetcher(), None)]
+        for domain_id in self.domain_ids:
+            sections.append(('domain_users:%s' % domain_id,
+                             self._domain_users_fetcher(domain_id), domain_id))
+        return sections
+
+    def _domains_fetcher(self):
+        def fetch(page):
+            if page > 1:
+                return []
+            return [self.client.get_domain(domain_id)
+                    for domain_id in self.domain_ids]
+        return fetch
+
+    def _domain_users_fetcher(self, domain_id):
+        return lambda page: self.client.get_domain_users(domain_id, page)
+
+    def _records(self, section, items, domain_id):
+        if section == 'users':
+            return [{'type': 'user', 'data': item} for item in items]
+
+        if section == 'hardware_tokens':
+            return [{'type': 'hardware_token', 'data': item} for item in items]
+
+        if section == 'domains':
+            return [{'type': 'domain', 'data': item} for item in items]
+
+        records = [{'type': 'domain_user', 'domain_id': domain_id,
+                    'user_id': item['id']} for item in items]
+
+        if self.tokens:
+            user_ids = [item['id'] for item in items]
+            results = _run_concurrently(
+                lambda user_id: self.client.get_user_token(domain_id, user_id),
+                user_ids, self.max_workers)
+            for user_id, token in zip(user_ids, results):
+                if isinstance(token, NoTokenException):
+                    continue
+                if isinstance(token, Exception):
+                    raise token
+                records.append({'type': 'user_token', 'domain_id': domain_id,
+                                'user_id': user_id, 'data': token})
+
+        return records
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _save_state(self, state):
+        tmp_path = '%s.tmp' % self.state_path
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def run(self, resume=False):
+        """
+        Write the snapshot. With resume set, an interrupted JSON Lines export
+        of the same path continues from its last checkpoint.
+
+        Returns a dict with the number of records written per record type.
+        """
+        if resume and self.format != 'jsonl':
+            raise ValueError('Only jsonl exports can be resumed.')
+
+        state = self._load_state() if resume else None
+        if state is None:
+            state = {'section': 0, 'page': 0, 'offset': 0, 'counts': {}}
+
+        if self.format == 'jsonl':
+            writer = _JSONLWriter(self.path, state['offset'])
+        else:
+            writer = _ParquetWriter(self.path)
+
+        try:
+            sections = self._sections()
+            while state['section'] < len(sections):
+                section, fetch, domain_id = sections[state['section']]
+                for page, items in _iter_page_batches(
+                        fetch, state['page'] + 1, self.max_workers):
+                    records = self._records(section, items, domain_id)
+                    state['offset'] = writer.write(records)
+                    state['page'] = page
+                    for record in records:
+                        state['counts'][record['type']] = \
+                            state['counts'].get(record['type'], 0) + 1
+                    if self.format == 'jsonl':
+                        self._save_state(state)
+                state['section'] += 1
+                state['page'] = 0
+        finally:
+            writer.close()
+
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+        return state['counts']
+
+
+def export_snapshot(client, path, domain_ids=(), tokens=True, format='jsonl',
+                    max_workers=4, resume=False):
+    """
+    Export an organization snapshot to path. See Exporter for the options.
+
+    Returns a dict with the number of records written per record type.
+    """
+    return Exporter(client, path, domain_ids, tokens, format,
+                    max_workers).run(resume=resume)
+
+
+def read_snapshot(path):
+    """
+    Read a JSON Lines snapshot written by export_snapshot(), either as written
+    or decompressed.
+
+    Returns a generator of record dicts.
+    """
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+        f.seek(0)
+        lines = gzip.GzipFile(fileobj=f, mode='rb') if compressed else f
+        for line in lines:
+            if line.strip():
+                yield json.loads(line.decode('utf-8'))
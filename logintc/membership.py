@@ -0,0 +1,141 @@
+"""
+In-memory index of domain memberships, for answering "is this user in the
+domain?" locally before creating a session.
+
+An index holds a 64-bit hash of each member's user id in a set, so a lookup
+is a constant-time set membership test and each member costs a few dozen
+bytes regardless of the id length. Indexes are created through
+LoginTC.index_domain(), which keeps them up to date as add_domain_user,
+remove_domain_user and set_domain_users are called on the same client.
+"""
+
+import hashlib
+import threading
+
+
+def _hash(user_id):
+    return int.from_bytes(
+        hashlib.blake2b(user_id.encode('utf-8'), digest_size=8).digest(),
+        'big')
+
+
+class MembershipIndex(object):
+    """
+    Set of the user ids that are members of a domain.
+
+    The index is rebuilt from the domain's user pages by refresh(), and, if
+    refresh_interval is given, every refresh_interval seconds from a
+    background thread. Refreshes run one at a time; one that is started
+    while another is running waits for it and then fetches the pages again.
+    """
+
+    def __init__(self, client, domain_id, refresh_interval=None):
+        self.client = client
+        self.domain_id = domain_id
+        self.refresh_interval = refresh_interval
+        self._members = set()
+        self._changes = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __contains__(self, user_id):
+        return _hash(user_id) in self._members
+
+    def __len__(self):
+        return len(self._members)
+
+    def contains(self, user_id):
+        """
+        Returns True if the user is a member of the domain.
+        """
+        return user_id in self
+
+    def _apply(self, change, user_id):
+        with self._lock:
+            getattr(self._members, change)(_hash(user_id))
+            if self._changes is not None:
+                self._changes.append((change, user_id))
+
+    def add(self, user_id):
+        self._apply('add', user_id)
+
+    def discard(self, user_id):
+        self._apply('discard', user_id)
+
+    def refresh(self):
+        """
+        Rebuild the index from the domain's users.
+        """
+        with self._refresh_lock:
+            with self._lock:
+                # Record changes made while the pages are fetched, so that
+                # they can be replayed onto the new set.
+                self._changes = []
+
+            try:
+                members = set(_hash(user['id']) for user in
+                              self.client.iter_domain_users(self.domain_id))
+            except Exception:
+                with self._lock:
+                    self._changes = None
+                raise
+
+            with self._lock:
+                for change, user_id in self._changes:
+                    getattr(members, change)(_hash(user_id))
+                self._members = members
+                self._changes = None
+
+    def refresh_in_background(self):
+        """
+        Start a refresh in a background thread.
+        """
+        thread = threading.Thread(target=self._refresh_quietly)
+        thread.daemon = True
+        thread.start()
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception:
+            # Keep answering from the previous members until the next refresh.
+            pass
+
+    def start(self):
+        """
+        Start refreshing every refresh_interval seconds, if it is set.
+        """
+        if self.refresh_interval is None or self._thread is not None:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the periodic refresh.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            self._refresh_quietly()
+
+    def after_fork(self):
+        """
+        Replace the locks and restart the periodic refresh, since threads do
+        not survive a fork.
+        """
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._changes = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.start()
@@ -0,0 +1,282 @@
+"""
+A local SQLite mirror of a LoginTC organization's users, domain memberships,
+hardware tokens and bypass codes.
+
+Lookups that do not need real-time data (username to user id, membership
+checks, token reports) can be answered from the mirror without an API call.
+The mirror is filled from the paginated REST API and refreshed incrementally:
+each refresh compares the fetched data with the stored rows and only writes
+the rows that were added, changed or removed.
+
+Secrets are not mirrored: bypass codes are stored without their code.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+from logintc.client import _run_concurrently
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_username ON users (username);
+
+CREATE TABLE IF NOT EXISTS memberships (
+    domain_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    PRIMARY KEY (domain_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS memberships_user_id ON memberships (user_id);
+
+CREATE TABLE IF NOT EXISTS hardware_tokens (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS bypass_codes (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bypass_codes_user_id ON bypass_codes (user_id);
+"""
+
+
+# Fields left out of mirrored bypass codes.
+SECRET_FIELDS = ('code',)
+
+
+def _dumps(item):
+    return json.dumps(item, sort_keys=True)
+
+
+def _without_secrets(item):
+    return dict((key, value) for key, value in item.items()
+                if key not in SECRET_FIELDS)
+
+
+class Mirror(object):
+    """
+    Local, indexed copy of organization data backed by SQLite.
+
+    Memberships are mirrored for the given domain_ids. Bypass codes require
+    one request per user and are only mirrored when bypass_codes is set.
+    The database lives in memory unless a file path is given, in which case
+    the file is created readable by its owner only.
+    """
+
+    def __init__(self, client, domain_ids=(), path=':memory:',
+                 bypass_codes=False):
+        self.client = client
+        self.domain_ids = list(domain_ids)
+        self.bypass_codes = bypass_codes
+
+        if path != ':memory:':
+            os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """
+        Fetch the current organization data and apply the differences to the
+        mirror.
+
+        Returns the number of rows that were inserted, updated or deleted.
+        """
+        users = {}
+        for user in self.client.iter_users():
+            users[(user['id'],)] = (user['id'], user['username'], _dumps(user))
+
+        memberships = {}
+        for domain_id in self.domain_ids:
+            for user in self.client.iter_domain_users(domain_id):
+                key = (domain_id, user['id'])
+                memberships[key] = key
+
+        hardware_tokens = {}
+        for token in self.client.iter_hardware_tokens():
+            hardware_tokens[(token['id'],)] = (token['id'], _dumps(token))
+
+        bypass_codes = None
+        failed_user_ids = set()
+        if self.bypass_codes:
+            bypass_codes = {}
+            user_ids = [key[0] for key in users]
+            results = _run_concurrently(self.client.get_bypass_codes,
+                                        user_ids,
+                                        self.client.DEFAULT_MAX_WORKERS)
+            for user_id, codes in zip(user_ids, results):
+                if isinstance(codes, Exception):
+                    failed_user_ids.add(user_id)
+                    continue
+                for code in codes:
+                    bypass_codes[(code['id'],)] = (
+                        code['id'], user_id, _dumps(_without_secrets(code)))
+
+        with self._lock, self._db:
+            changes = self._sync('users', ('id',), ('id', 'username', 'data'),
+                                 users)
+            changes += self._sync('memberships', ('domain_id', 'user_id'),
+                                  ('domain_id', 'user_id'), memberships)
+            changes += self._sync('hardware_tokens', ('id',), ('id', 'data'),
+                                  hardware_tokens)
+            if bypass_codes is not None:
+                # Keep the previous rows of users whose lookup failed.
+                for row in self._db.execute(
+                        'SELECT id, user_id, data FROM bypass_codes'):
+                    if row[1] in failed_user_ids:
+                        bypass_codes[(row[0],)] = row
+                changes += self._sync('bypass_codes', ('id',),
+                                      ('id', 'user_id', 'data'), bypass_codes)
+
+        return changes
+
+    def _sync(self, table, key_columns, columns, rows):
+        """
+        Make table hold exactly rows, a dict mapping key tuples to row tuples.
+        """
+        existing = {}
+        for row in self._db.execute('SELECT %s FROM %s' %
+                                    (', '.join(columns), table)):
+            existing[row[:len(key_columns)]] = row
+
+        removed = [key for key in existing if key not in rows]
+        changed = [row for key, row in rows.items()
+                   if existing.get(key) != tuple(row)]
+
+        where = ' AND '.join('%s = ?' % column for column in key_columns)
+        self._db.executemany('DELETE FROM %s WHERE %s' % (table, where),
+                             removed)
+        self._db.executemany('INSERT OR REPLACE INTO %s (%s) VALUES (%s)' %
+                             (table, ', '.join(columns),
+                              ', '.join('?' * len(columns))), changed)
+
+        return len(removed) + len(changed)
+
+    def start(self, interval):
+        """
+        Refresh the mirror now and then every interval seconds from a
+        background thread, until stop() is called.
+        """
+        self.refresh()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background refresh started by start().
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.refresh()
+            except Exception:
+                # Keep serving the previous data until the next attempt.
+                pass
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def get_user(self, user_id):
+        """
+        Get a mirrored user.
+
+        Returns a dict containing the user's information, or None.
+        """
+        rows = self._query('SELECT data FROM users WHERE id = ?', (user_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def get_user_by_username(self, username):
+        """
+        Get a mirrored user by username.
+
+        Returns a dict containing the user's information, or None.
+        """
+        rows = self._query('SELECT data FROM users WHERE username = ?',
+                           (username,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def get_domain_users(self, domain_id):
+        """
+        Get a domain's mirrored users.
+
+        Returns a list of dicts containing each user's information.
+        """
+        rows = self._query('SELECT users.data FROM memberships '
+                           'JOIN users ON users.id = memberships.user_id '
+                           'WHERE memberships.domain_id = ? '
+                           'ORDER BY users.username', (domain_id,))
+        return [json.loads(row[0]) for row in rows]
+
+    def get_user_domain_ids(self, user_id):
+        """
+        Get the ids of the mirrored domains a user is a member of.
+
+        Returns a list of domain ids.
+        """
+        rows = self._query('SELECT domain_id FROM memberships '
+                           'WHERE user_id = ? ORDER BY domain_id', (user_id,))
+        return [row[0] for row in rows]
+
+    def is_domain_user(self, domain_id, user_id):
+        """
+        Check whether a user is a member of a mirrored domain.
+
+        Returns True or False.
+        """
+        return bool(self._query('SELECT 1 FROM memberships '
+                                'WHERE domain_id = ? AND user_id = ?',
+                                (domain_id, user_id)))
+
+    def get_hardware_token(self, hardware_token_id):
+        """
+        Get a mirrored hardware token.
+
+        Returns a dict containing the hardware token's information, or None.
+        """
+        rows = self._query('SELECT data FROM hardware_tokens WHERE id = ?',
+                           (hardware_token_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def get_hardware_tokens(self):
+        """
+        Get all mirrored hardware tokens.
+
+        Returns a list of dicts containing each hardware token's information.
+        """
+        rows = self._query('SELECT data FROM hardware_tokens ORDER BY id')
+        return [json.loads(row[0]) for row in rows]
+
+    def get_bypass_codes(self, user_id):
+        """
+        Get a user's mirrored bypass codes.
+
+        Returns a list of dicts containing each bypass code's information.
+        """
+        rows = self._query('SELECT data FROM bypass_codes WHERE user_id = ? '
+                           'ORDER BY id', (user_id,))
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self):
+        """
+        Stop any background refresh and close the database.
+        """
+        self.stop()
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,221 @@
+"""
+Record and replay of REST API traffic.
+
+A RecordingTransport wraps the client's transport and appends every
+exchange (request, response status, headers, body and elapsed time) to a
+gzip-compressed JSON Lines file, with the API key and secret fields
+redacted. A ReplayTransport plays such a file back to a client without any
+network access, either at the recorded speed or as fast as possible::
+
+    client = logintc.LoginTC(api_key)
+    client.http = RecordingTransport(client.http, 'traffic.jsonl.gz')
+    ...
+    client.http.close()
+
+    client = logintc.LoginTC('key', coalesce=False)
+    client.http = ReplayTransport('traffic.jsonl.gz', speed=1.0)
+
+Requests are matched on method, path and query, ignoring the host, so a
+recording can be replayed against any host list.
+"""
+
+import base64
+import gzip
+import json
+import socket
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import httplib2
+
+REDACTED = 'REDACTED'
+
+# Headers and JSON body fields whose values are secrets.
+REDACT_HEADERS = ('authorization', 'cookie', 'set-cookie')
+REDACT_FIELDS = ('seed', 'code', 'bypasscode', 'otp')
+
+# Transport errors that are recorded and raised again on replay.
+_ERRORS = {
+    'timeout': socket.timeout,
+    'connection_refused': ConnectionRefusedError,
+    'server_not_found': httplib2.ServerNotFoundError,
+}
+
+
+def _request_key(method, uri):
+    parts = urlsplit(uri)
+    if parts.query:
+        return '%s %s?%s' % (method, parts.path, parts.query)
+    return '%s %s' % (method, parts.path)
+
+
+def _redact_json(value, fields):
+    if isinstance(value, dict):
+        return dict((key, REDACTED if key in fields else
+                     _redact_json(item, fields))
+                    for key, item in value.items())
+    if isinstance(value, list):
+        return [_redact_json(item, fields) for item in value]
+    return value
+
+
+def _encode_body(body, fields):
+    """
+    Returns the JSON representation of a request or response body.
+    """
+    if body is None:
+        return None
+
+    if isinstance(body, bytes):
+        try:
+            text = body.decode('utf-8')
+        except UnicodeDecodeError:
+            return {'base64': base64.b64encode(body).decode('ascii')}
+    else:
+        text = body
+
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return {'text': text}
+
+    # Error codes are not secret and are needed to replay the errors.
+    if not (isinstance(data, dict) and 'errors' in data):
+        data = _redact_json(data, fields)
+
+    return {'text': json.dumps(data)}
+
+
+def _decode_body(body):
+    if body is None:
+        return b''
+    if 'base64' in body:
+        return base64.b64decode(body['base64'])
+    return body['text'].encode('utf-8')
+
+
+class RecordingTransport(object):
+    """
+    Transport that passes requests on to transport and records each exchange
+    to path.
+
+    Values of the headers in redact_headers and of the JSON fields in
+    redact_fields, at any depth of a request or response body, are replaced
+    with REDACTED before they are written.
+    """
+
+    def __init__(self, transport, path, redact_headers=REDACT_HEADERS,
+                 redact_fields=REDACT_FIELDS):
+        self.transport = transport
+        self.path = path
+        self.redact_headers = set(name.lower() for name in redact_headers)
+        self.redact_fields = set(redact_fields)
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Pool management (size, after_fork, ...) is left to the transport.
+        return getattr(self.transport, name)
+
+    def _headers(self, headers):
+        return dict((key, REDACTED if key.lower() in self.redact_headers
+                     else value) for key, value in (headers or {}).items())
+
+    def request(self, uri, method, headers=None, body=None, timeout=None):
+        kwargs = {}
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+
+        record = {'key': _request_key(method, uri),
+                  'request': {'headers': self._headers(headers),
+                              'body': _encode_body(body, self.redact_fields)}}
+
+        start = time.monotonic()
+        try:
+            response, content = self.transport.request(
+                uri, method, headers=headers, body=body, **kwargs)
+        except tuple(_ERRORS.values()) as e:
+            for name, error in _ERRORS.items():
+                if isinstance(e, error):
+                    record['error'] = name
+                    break
+            record['elapsed'] = time.monotonic() - start
+            self._write(record)
+            raise
+
+        record['elapsed'] = time.monotonic() - start
+        record['response'] = {
+            'headers': self._headers(response),
+            'body': _encode_body(content, self.redact_fields)}
+        self._write(record)
+
+        return response, content
+
+    def _write(self, record):
+        line = json.dumps(record, sort_keys=True)
+        with self._lock:
+            self._file.write(line)
+            self._file.write('\n')
+
+    def close(self):
+        """
+        Finish writing the recording.
+        """
+        with self._lock:
+            self._file.close()
+
+
+class ReplayTransport(object):
+    """
+    Transport that answers requests from a recording made by
+    RecordingTransport.
+
+    Each request gets the next recorded exchange with the same method, path
+    and query; once those have all been used the last one is repeated. If
+    speed is given, every answer is delayed by its recorded time divided by
+    speed, so speed=1.0 replays at the recorded speed. Otherwise answers are
+    returned immediately.
+
+    Raises KeyError for a request that was never recorded.
+    """
+
+    def __init__(self, path, speed=None):
+        self.path = path
+        self.speed = speed
+        self._exchanges = {}
+        self._lock = threading.Lock()
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._exchanges.setdefault(record['key'],
+                                               deque()).append(record)
+
+    def _next(self, key):
+        with self._lock:
+            exchanges = self._exchanges.get(key)
+            if not exchanges:
+                raise KeyError('No recorded exchange for %s' % key)
+            if len(exchanges) > 1:
+                return exchanges.popleft()
+            return exchanges[0]
+
+    def request(self, uri, method, headers=None, body=None, timeout=None):
+        record = self._next(_request_key(method, uri))
+
+        if self.speed:
+            delay = record['elapsed'] / self.speed
+            if timeout is not None and delay > timeout:
+                time.sleep(timeout)
+                raise socket.timeout('timed out')
+            time.sleep(delay)
+
+        if 'error' in record:
+            raise _ERRORS[record['error']]('Recorded %s' % record['error'])
+
+        response = record['response']
+        return (httplib2.Response(response['headers']),
+                _decode_body(response['body']))
@@ -0,0 +1,153 @@
+"""
+Organization health report across users, tokens and bypass codes.
+
+The report walks the organization's users page by page and, for each page,
+looks up every user's tokens, bypass codes and hardware token concurrently.
+Findings are written to an output stream as they are found, one JSON object
+per line::
+
+    {"finding": "no_active_token", "domain_id": "...", "user_id": "...",
+     "username": "...", "state": "pending"}
+    {"finding": "live_bypass_codes", "user_id": "...", "username": "...",
+     "count": 2}
+    {"finding": "unassigned_hardware_token", "hardware_token_id": "..."}
+    {"finding": "error", "user_id": "...", "message": "..."}
+
+Only one page of users is held in memory at a time, plus the ids of the
+hardware tokens assigned to users.
+"""
+
+import json
+import time
+
+from logintc.client import _run_concurrently
+from logintc.exceptions import APIException, NoTokenException
+
+
+class HealthReport(object):
+    """
+    Builds the health report for domain_ids, or for every domain the users
+    belong to if domain_ids is not given.
+
+    progress, if given, is called after each page of users as
+    progress(users_done, total_users, eta) where eta is the estimated number
+    of seconds remaining, or None when total_users is unknown.
+    """
+
+    def __init__(self, client, domain_ids=None, max_workers=10,
+                 progress=None, total_users=None):
+        self.client = client
+        self.domain_ids = set(domain_ids) if domain_ids is not None else None
+        self.max_workers = max_workers
+        self.progress = progress
+        self.total_users = total_users
+
+    def _check_user(self, user):
+        """
+        Look up one user's tokens, bypass codes and hardware token.
+
+        Returns a (findings, hardware_token_id) tuple.
+        """
+        findings = []
+
+        for domain_id in user.get('domains', []):
+            if self.domain_ids is not None and domain_id not in self.domain_ids:
+                continue
+            try:
+                state = self.client.get_user_token(domain_id,
+                                                   user['id'])['state']
+            except NoTokenException:
+                state = None
+            if state != 'active':
+                findings.append({'finding': 'no_active_token',
+                                 'domain_id': domain_id, 'user_id': user['id'],
+                                 'username': user['username'],
+                                 'state': state})
+
+        codes = [code for code in self.client.get_bypass_codes(user['id'])
+                 if code.get('usesRemaining', 1) != 0]
+        if codes:
+            findings.append({'finding': 'live_bypass_codes',
+                             'user_id': user['id'],
+                             'username': user['username'],
+                             'count': len(codes)})
+
+        hardware_token_id = None
+        try:
+            hardware_token_id = \
+                self.client.get_user_hardware_token(user['id']).get('id')
+        except APIException as e:
+            if not e.code.startswith('api.error.notfound'):
+                raise
+
+        return findings, hardware_token_id
+
+    def run(self, out):
+        """
+        Run the report, writing each finding to the out stream as a line of
+        JSON.
+
+        Returns a dict of aggregate counts: users checked, users without an
+        active token per domain, users with live bypass codes, unassigned
+        hardware tokens and lookup errors.
+        """
+        totals = {'users': 0, 'no_active_token': {}, 'live_bypass_codes': 0,
+                  'unassigned_hardware_tokens': 0, 'errors': 0}
+        assigned = set()
+        start = time.monotonic()
+
+        def write(finding):
+            out.write(json.dumps(finding, sort_keys=True))
+            out.write('\n')
+
+        page = 1
+        while True:
+            users = self.client.get_users(page)
+            if not users:
+                break
+
+            results = _run_concurrently(self._check_user, users,
+                                        self.max_workers)
+            for user, result in zip(users, results):
+                if isinstance(result, Exception):
+                    totals['errors'] += 1
+                    write({'finding': 'error', 'user_id': user['id'],
+                           'message': str(result)})
+                    continue
+
+                findings, hardware_token_id = result
+                if hardware_token_id is not None:
+                    assigned.add(hardware_token_id)
+                for finding in findings:
+                    if finding['finding'] == 'no_active_token':
+                        counts = totals['no_active_token']
+                        counts[finding['domain_id']] = \
+                            counts.get(finding['domain_id'], 0) + 1
+                    else:
+                        totals['live_bypass_codes'] += 1
+                    write(finding)
+
+            totals['users'] += len(users)
+            out.flush()
+            self._report_progress(totals['users'], start)
+            page += 1
+
+        for hardware_token in self.client.iter_hardware_tokens():
+            if hardware_token['id'] not in assigned:
+                totals['unassigned_hardware_tokens'] += 1
+                write({'finding': 'unassigned_hardware_token',
+                       'hardware_token_id': hardware_token['id']})
+        out.flush()
+
+        return totals
+
+    def _report_progress(self, done, start):
+        if self.progress is None:
+            return
+
+        eta = None
+        elapsed = time.monotonic() - start
+        if self.total_users is not None and done and elapsed > 0:
+            eta = max(self.total_users - done, 0) * elapsed / done
+
+        self.progress(done, self.total_users, eta)
@@ -0,0 +1,55 @@
+"""
+Test case base for tests that run a LoginTC client against canned REST API
+responses instead of the network.
+"""
+
+import unittest
+import json
+import logintc
+
+BASE_URI = 'https://cloud.logintc.com/api'
+
+
+class MockAPITestCase(unittest.TestCase):
+    """
+    Test case whose client answers requests from self.responses, a dict
+    mapping (method, url) to a (headers, body) tuple, and records the
+    (method, url) of every request in self.requests.
+
+    A request without a response gets default_response, or raises KeyError
+    if default_response is None.
+    """
+    default_response = None
+
+    def setUp(self):
+        self.responses = {}
+        self.requests = []
+        self.client = self.mock_client()
+
+    def mock_client(self, **kwargs):
+        client = logintc.LoginTC('key', **kwargs)
+        client.http.request = self._mock_request
+        return client
+
+    def _mock_request(self, url, method, headers, body=None):
+        self.requests.append((method, url))
+        if (method, url) not in self.responses and \
+                self.default_response is not None:
+            return self.default_response
+        return self.responses[(method, url)]
+
+    def set_response(self, method, url, headers, body):
+        self.responses[(method, BASE_URI + url)] = (headers, body)
+
+    def set_pages(self, url, pages):
+        """
+        Answer each page of url, followed by an empty page.
+        """
+        for page, items in enumerate(pages + [[]], 1):
+            self.set_response('GET', '%s?page=%d' % (url, page),
+                              {'status': '200'}, json.dumps(items))
+
+    def set_not_found(self, url, code):
+        self.set_response('GET', url, {'status': '404'},
+                          json.dumps({'errors': [{'code': code,
+                                                  'message': 'Not found.'}]}))
@@ -1,6 +1,18 @@
 import unittest
+import gc
+import gzip
+import http.server
 import json
+import os
+import random
+import socket
+import threading
+import time
+import weakref
+import httplib2
 import logintc
+import logintc.client
+import logintc.membership
 
 
 class TestLoginTCClient(unittest.TestCase):
@@ -351,5 +363,645 @@ class TestLoginTCClient(unittest.TestCase):
 
         self.assertEqual('Hello World!', res)
 
+    def test_bulk_create_bypass_codes(self):
+        other_user_id = 'b8e4c3e2a1f0b8e4c3e2a1f0b8e4c3e2a1f0b8e4'
+        self.set_response('POST',
+                          '/users/%s/bypasscodes' % self.user_id,
+                          {'status': '200'},
+                          json.dumps({'code': '123456789'}))
+        self.set_response('POST',
+                          '/users/%s/bypasscodes' % other_user_id,
+                          {'status': '404'},
+                          json.dumps({'errors': [
+                              {'code': 'api.error.notfound.user',
+                               'message': 'User not found.'}]}))
+
+        res = self.client.bulk_create_bypass_codes(
+            [self.user_id, other_user_id], uses_allowed=3, rate_limit=100)
+
+        self.assertEqual({'code': '123456789'}, res[self.user_id])
+        self.assertIsInstance(res[other_user_id], logintc.APIException)
+        self.assertTrue(self.verify_request(
+            'POST', '/users/%s/bypasscodes' % self.user_id,
+            {'usesAllowed': 3, 'expirationTime': 0}))
+
+    def test_bulk_delete_bypass_codes_for_domain(self):
+        self.set_response('GET',
+                          '/domains/%s/users?page=1' % self.domain_id,
+                          {'status': '200'},
+                          json.dumps([{'id': self.user_id,
+                                       'username': self.user_username}]))
+        self.set_response('GET',
+                          '/domains/%s/users?page=2' % self.domain_id,
+                          {'status': '200'},
+                          json.dumps([]))
+        path = '/users/%s/bypasscodes' % self.user_id
+        self.set_response('DELETE', path, {'status': '200'}, '')
+
+        res = self.client.bulk_delete_bypass_codes(domain_id=self.domain_id)
+
+        self.assertEqual({self.user_id: None}, res)
+        self.assertTrue(self.verify_request('DELETE', path))
+
+    def test_coalesced_waiter_outlives_leader_timeout(self):
+        def _slow_request(url, method, headers, body=None, timeout=None):
+            if timeout is not None and timeout < 0.2:
+                time.sleep(timeout)
+                raise socket.timeout()
+            time.sleep(0.2)
+            return {'status': '200'}, json.dumps({'name': self.domain_name})
+
+        self.client.http.request = _slow_request
+        errors = []
+
+        def leader():
+            try:
+                self.client.get_domain(self.domain_id, timeout=0.05)
+            except logintc.TimeoutException as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=leader)
+        thread.start()
+        time.sleep(0.01)
+
+        self.assertEqual({'name': self.domain_name},
+                         self.client.get_domain(self.domain_id))
+        thread.join()
+        self.assertEqual(1, len(errors))
+
+    def test_get_users_by_ids(self):
+        other_user_id = 'b8e4c3e2a1f0b8e4c3e2a1f0b8e4c3e2a1f0b8e4'
+        self.set_response('GET', '/users/%s' % self.user_id,
+                          {'status': '200'},
+                          json.dumps({'id': self.user_id}))
+        self.set_response('GET', '/users/%s' % other_user_id,
+                          {'status': '404'},
+                          json.dumps({'errors': [
+                              {'code': 'api.error.notfound.user',
+                               'message': 'User not found.'}]}))
+
+        res = self.client.get_users_by_ids([other_user_id, self.user_id])
+
+        self.assertIsInstance(res[0], logintc.APIException)
+        self.assertEqual({'id': self.user_id}, res[1])
+
+    def test_get_user_tokens(self):
+        other_user_id = 'b8e4c3e2a1f0b8e4c3e2a1f0b8e4c3e2a1f0b8e4'
+        path = '/domains/%s/users/%%s/token' % self.domain_id
+        self.set_response('GET', path % self.user_id, {'status': '200'},
+                          json.dumps({'state': 'active'}))
+        self.set_response('GET', path % other_user_id, {'status': '404'},
+                          json.dumps({'errors': [
+                              {'code': 'api.error.notfound.token',
+                               'message': 'No token loaded for user.'}]}))
+
+        res = self.client.get_user_tokens(self.domain_id,
+                                          [self.user_id, other_user_id])
+
+        self.assertEqual({'state': 'active'}, res[0])
+        self.assertIsInstance(res[1], logintc.NoTokenException)
+
+    def test_concurrent_identical_gets_are_coalesced(self):
+        calls = []
+        release = threading.Event()
+
+        def _slow_request(url, method, headers, body=None):
+            calls.append(url)
+            release.wait(5)
+            return {'status': '200'}, json.dumps({'name': self.domain_name})
+
+        self.client.http.request = _slow_request
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            self.client.get_domain(self.domain_id))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual([{'name': self.domain_name}] * 5, results)
+
+    def test_timeout_is_passed_to_transport(self):
+        timeouts = []
+
+        def _request(url, method, headers, body=None, timeout=None):
+            timeouts.append(timeout)
+            return {'status': '200'}, json.dumps({'state': 'pending'})
+
+        self.client.http.request = _request
+        self.client.get_session(self.domain_id, self.session_id, timeout=2)
+
+        self.assertTrue(0 < timeouts[0] <= 2)
+
+    def test_socket_timeout_raises_timeout_exception(self):
+        def _request(url, method, headers, body=None, timeout=None):
+            raise socket.timeout()
+
+        self.client.http.request = _request
+
+        self.assertRaises(logintc.TimeoutException,
+                          self.client.create_session, self.domain_id,
+                          username='test', timeout=1)
+
+    def test_expired_deadline_raises_timeout_exception(self):
+        def _request(url, method, headers, body=None, timeout=None):
+            return {'status': '200'}, json.dumps({'state': 'pending'})
+
+        self.client.http.request = _request
+
+        with self.client.deadline(0.05):
+            self.client.get_session(self.domain_id, self.session_id)
+            time.sleep(0.1)
+            self.assertRaises(logintc.TimeoutException,
+                              self.client.get_session, self.domain_id,
+                              self.session_id)
+
+    def test_hedged_get(self):
+        calls = []
+
+        def _request(url, method, headers, body=None):
+            calls.append(threading.current_thread())
+            if len(calls) == 21:
+                time.sleep(1)
+                return {'status': '200'}, json.dumps({'state': 'slow'})
+            return {'status': '200'}, json.dumps({'state': 'pending'})
+
+        client = logintc.LoginTC(self.api_key, hedge=True, hedge_max_ratio=1)
+        client.http.request = _request
+        for _ in range(20):
+            client.get_session(self.domain_id, self.session_id)
+
+        res = client.get_session(self.domain_id, self.session_id)
+
+        self.assertEqual({'state': 'pending'}, res)
+        self.assertEqual({'requests': 21, 'hedged': 1, 'wins': 1},
+                         client.hedge_stats())
+        self.assertEqual([threading.current_thread()] * 21, calls[:21])
+
+    def test_hedge_interrupts_slow_request(self):
+        requests = []
+
+        class _Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                requests.append(self.path)
+                if len(requests) == 21:
+                    time.sleep(2)
+                body = json.dumps({'state': 'pending'}).encode()
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            client = logintc.LoginTC(self.api_key, secure=False,
+                                     host='127.0.0.1:%d' % server.server_port,
+                                     hedge=True, hedge_max_ratio=1)
+            for _ in range(20):
+                client.get_session(self.domain_id, self.session_id)
+
+            start = time.monotonic()
+            res = client.get_session(self.domain_id, self.session_id)
+            elapsed = time.monotonic() - start
+            sent = len(requests)
+            wins = client.hedge_stats()['wins']
+            for _ in range(5):
+                client.get_session(self.domain_id, self.session_id)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual({'state': 'pending'}, res)
+        self.assertLess(elapsed, 1)
+        self.assertEqual(22, sent)
+        self.assertEqual(1, wins)
+        self.assertFalse(any(client.http._aborted(http)
+                             for http in client.http._idle))
+        self.assertTrue(all(stats['healthy']
+                            for stats in client.host_stats().values()))
+
+    def test_hedge_abort_only_hits_its_own_attempt(self):
+        call = logintc.client._HedgedCall(None, None)
+        http = httplib2.Http()
+        conn = logintc.client._HTTPConnection('127.0.0.1', 1)
+        http.connections['http:127.0.0.1:1'] = conn
+
+        call.attach(http)
+        call.detach(http)
+        call.abort()
+
+        self.assertFalse(conn.aborted)
+        self.assertRaises(ConnectionAbortedError, call.attach, http)
+
+    def test_failover_to_next_host(self):
+        urls = []
+
+        def _request(url, method, headers, body=None):
+            urls.append(url)
+            if url.startswith('https://a.example.com'):
+                raise socket.error('Connection reset')
+            return {'status': '200'}, json.dumps({'status': 'OK'})
+
+        client = logintc.LoginTC(self.api_key,
+                                 host=['a.example.com', 'b.example.com'])
+        client.http.request = _request
+
+        self.assertEqual({'status': 'OK'}, client.get_ping())
+        self.assertEqual({'status': 'OK'}, client.get_ping())
+
+        self.assertEqual(['https://a.example.com/api/ping',
+                          'https://b.example.com/api/ping',
+                          'https://b.example.com/api/ping'], urls)
+        stats = client.host_stats()
+        self.assertFalse(stats['a.example.com']['healthy'])
+        self.assertTrue(stats['b.example.com']['healthy'])
+
+    def test_fastest_host_is_chosen(self):
+        urls = []
+
+        def _request(url, method, headers, body=None):
+            urls.append(url)
+            if url.startswith('https://a.example.com'):
+                time.sleep(0.05)
+            return {'status': '200'}, json.dumps({'status': 'OK'})
+
+        client = logintc.LoginTC(self.api_key,
+                                 host=['a.example.com', 'b.example.com'])
+        client.http.request = _request
+
+        self.assertEqual({'a.example.com': True, 'b.example.com': True},
+                         client.check_hosts())
+        client.get_organization()
+
+        self.assertEqual('https://b.example.com/api/organization', urls[-1])
+
+    def test_state_is_reset_after_fork(self):
+        self.set_response('GET', '/ping', {'status': '200'},
+                          json.dumps({'status': 'OK'}))
+        inherited = object()
+        self.client.http._idle.append(inherited)
+        self.client._pid = -1
+
+        self.client.get_ping()
+
+        self.assertEqual(os.getpid(), self.client._pid)
+        self.assertNotIn(inherited, self.client.http._idle)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork')
+    def test_fork_drops_inherited_connections(self):
+        self.client.http._idle.append(object())
+
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if not self.client.http._idle else 1)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+        self.assertEqual(1, len(self.client.http._idle))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork')
+    def test_keepalive_restarts_after_fork(self):
+        pings = []
+
+        def _request(url, method, headers, body=None, timeout=None):
+            pings.append(url)
+            return {'status': '200'}, json.dumps({'status': 'OK'})
+
+        client = logintc.LoginTC(self.api_key, keepalive_interval=0.1)
+        client.http.request = _request
+
+        pid = os.fork()
+        if pid == 0:
+            del pings[:]
+            time.sleep(0.5)
+            os._exit(0 if pings else 1)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+
+    def test_clients_are_garbage_collected(self):
+        client = logintc.LoginTC(self.api_key, keepalive_interval=0.05,
+                                 health_check_interval=0.05)
+        ref = weakref.ref(client)
+        del client
+        gc.collect()
+
+        self.assertIsNone(ref())
+
+    def test_warm_up(self):
+        urls = []
+
+        def _request(url, method, headers, body=None):
+            urls.append(url)
+            return {'status': '200'}, json.dumps({'status': 'OK'})
+
+        client = logintc.LoginTC(self.api_key,
+                                 host=['a.example.com', 'b.example.com'])
+        client.http.request = _request
+
+        self.assertEqual(6, client.warm_up(connections=3))
+        self.assertEqual(3, urls.count('https://a.example.com/api/ping'))
+        self.assertEqual(3, urls.count('https://b.example.com/api/ping'))
+        self.assertEqual(0, client.warm_up(connections=0))
+        self.assertEqual([], logintc.client._run_concurrently(len, [], 10))
+
+    def test_http_factory(self):
+        def _factory():
+            http = httplib2.Http(timeout=5)
+            http.add_credentials('user', 'password')
+            return http
+
+        client = logintc.LoginTC(self.api_key, http_factory=_factory)
+        http = client.http._checkout()
+
+        self.assertEqual(5, http.timeout)
+        self.assertEqual(1, len(http.credentials.credentials))
+        self.assertTrue(http.follow_all_redirects)
+
+    def test_tls_session_is_offered_on_reconnect(self):
+        wrapped = []
+
+        class _Context(object):
+            check_hostname = True
+
+            def wrap_socket(self, sock, server_hostname=None, session=None):
+                wrapped.append((server_hostname, session))
+                return sock
+
+        session = object()
+        context = logintc.client._SessionResumingContext(_Context(), session)
+
+        context.wrap_socket('sock', server_hostname='cloud.logintc.com')
+
+        self.assertEqual([('cloud.logintc.com', session)], wrapped)
+        self.assertTrue(context.check_hostname)
+
+    def test_compressed_responses_are_counted(self):
+        body = json.dumps([{'id': self.user_id,
+                            'username': self.user_username}] * 50).encode()
+        accept_encodings = []
+
+        class _Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                accept_encodings.append(self.headers['Accept-Encoding'])
+                content = gzip.compress(body)
+                self.send_response(200)
+                self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(('127.0.0.1', 0), _Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            client = logintc.LoginTC(self.api_key, secure=False,
+                                     host='127.0.0.1:%d' % server.server_port)
+            users = client.get_users(timeout=5)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(50, len(users))
+        self.assertIn('gzip', accept_encodings[0])
+        stats = client.transfer_stats()['GET /api/users']
+        self.assertEqual(1, stats['compressed'])
+        self.assertEqual(len(body), stats['uncompressed_bytes'])
+        self.assertLess(stats['compressed_bytes'], len(body) / 10)
+
+    def test_adaptive_concurrency_limit(self):
+        limiter = logintc.client._AdaptiveLimiter(4, initial=2)
+
+        for _ in range(20):
+            in_flight = limiter.stats()['limit']
+            for _ in range(in_flight):
+                limiter.acquire()
+            for _ in range(in_flight):
+                limiter.release(0.01, True)
+        self.assertEqual(4, limiter.stats()['limit'])
+
+        limiter.acquire()
+        limiter.release(0.01, False)
+        self.assertEqual(3, limiter.stats()['limit'])
+
+        limiter._last_decrease = 0.0
+        for _ in range(10):
+            limiter.acquire()
+            limiter.release(0.1, True)
+        stats = limiter.stats()
+        self.assertEqual(3, stats['limit'])
+        self.assertEqual(2, stats['decreases'])
+        self.assertEqual(0, stats['in_flight'])
+
+    def test_adaptive_concurrency_ignores_jitter(self):
+        rand = random.Random(0)
+        limiter = logintc.client._AdaptiveLimiter(20)
+
+        def _round(low, high):
+            in_flight = limiter.stats()['limit']
+            for _ in range(in_flight):
+                limiter.acquire()
+            for _ in range(in_flight):
+                limiter._last_decrease = 0.0
+                limiter.release(rand.uniform(low, high), True)
+
+        for _ in range(300):
+            _round(0.02, 0.05)
+        stats = limiter.stats()
+        self.assertEqual(20, stats['limit'])
+        self.assertEqual(0, stats['decreases'])
+
+        for _ in range(50):
+            _round(0.15, 0.2)
+        stats = limiter.stats()
+        self.assertLess(stats['limit'], 20)
+        self.assertGreater(stats['decreases'], 0)
+
+    def test_deadline_does_not_lower_concurrency_limit(self):
+        client = logintc.LoginTC(self.api_key, max_concurrency=20)
+        client.http.request = self.client.http.request
+
+        with logintc.client._deadline(deadline=time.monotonic() - 1):
+            self.assertRaises(logintc.TimeoutException, client.get_ping)
+
+        stats = client.concurrency_stats()
+        self.assertEqual(10, stats['limit'])
+        self.assertEqual(0, stats['errors'])
+        self.assertEqual(0, stats['decreases'])
+        self.assertEqual(0, stats['in_flight'])
+
+    def test_adaptive_concurrency_waits_for_slot(self):
+        limiter = logintc.client._AdaptiveLimiter(1)
+        limiter.acquire()
+
+        with logintc.client._deadline(0.05):
+            self.assertRaises(logintc.TimeoutException, limiter.acquire)
+
+    def test_client_reports_errors_to_limiter(self):
+        self.set_response('GET', '/ping', {'status': '503'}, '')
+        client = logintc.LoginTC(self.api_key, max_concurrency=20)
+        client.http.request = self.client.http.request
+
+        self.assertRaises(logintc.InternalAPIException, client.get_ping)
+
+        stats = client.concurrency_stats()
+        self.assertEqual(9, stats['limit'])
+        self.assertEqual(1, stats['errors'])
+        self.assertEqual(0, stats['in_flight'])
+        self.assertIsNone(self.client.concurrency_stats())
+
+    @unittest.skipUnless(logintc.client.brotli is not None,
+                         'requires brotli')
+    def test_brotli_responses_are_decoded(self):
+        brotli = logintc.client.brotli
+        body = json.dumps([{'id': self.user_id,
+                            'username': self.user_username}] * 50).encode()
+        accept_encodings = []
+
+        class _Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                accept_encodings.append(self.headers['Accept-Encoding'])
+                content = brotli.compress(body)
+                self.send_response(200)
+                self.send_header('Content-Encoding', 'br')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(('127.0.0.1', 0), _Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            client = logintc.LoginTC(self.api_key, secure=False,
+                                     host='127.0.0.1:%d' % server.server_port)
+            users = client.get_users(timeout=5)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(50, len(users))
+        self.assertIn('br', accept_encodings[0])
+        stats = client.transfer_stats()['GET /api/users']
+        self.assertEqual(1, stats['compressed'])
+        self.assertEqual(len(body), stats['uncompressed_bytes'])
+        self.assertLess(stats['compressed_bytes'], len(body) / 10)
+
+    @unittest.skipUnless(logintc.client.brotli is not None,
+                         'requires brotli')
+    def test_corrupt_brotli_response(self):
+        class _Http(object):
+            connections = {}
+
+            def request(self, uri, method, **kwargs):
+                return (httplib2.Response({'status': '200',
+                                           'content-encoding': 'br'}),
+                        b'not brotli')
+
+        pool = logintc.client._ConnectionPool()
+        pool._checkout = _Http
+
+        self.assertRaises(httplib2.FailedToDecompressContent, pool.request,
+                          'https://cloud.logintc.com/api/ping', 'GET')
+
+    def test_domain_membership_index(self):
+        other_user_id = 'b8e4c3e2a1f0b8e4c3e2a1f0b8e4c3e2a1f0b8e4'
+        self.set_response('GET',
+                          '/domains/%s/users?page=1' % self.domain_id,
+                          {'status': '200'},
+                          json.dumps([{'id': self.user_id}]))
+        self.set_response('GET',
+                          '/domains/%s/users?page=2' % self.domain_id,
+                          {'status': '200'}, json.dumps([]))
+        for method in ('PUT', 'DELETE'):
+            self.set_response(method, '/domains/%s/users/%s' %
+                              (self.domain_id, other_user_id),
+                              {'status': '200'}, '')
+
+        index = self.client.index_domain(self.domain_id)
+        self.requests.clear()
+
+        self.assertEqual(1, len(index))
+        self.assertTrue(self.client.is_domain_user(self.domain_id,
+                                                   self.user_id))
+        self.assertFalse(self.client.is_domain_user(self.domain_id,
+                                                    other_user_id))
+        self.client.add_domain_user(self.domain_id, other_user_id)
+        self.assertTrue(self.client.is_domain_user(self.domain_id,
+                                                   other_user_id))
+        self.client.remove_domain_user(self.domain_id, other_user_id)
+        self.assertFalse(self.client.is_domain_user(self.domain_id,
+                                                    other_user_id))
+        self.assertEqual(2, len(self.requests))
+
+    def test_overlapping_membership_refreshes(self):
+        other_user_id = 'b8e4c3e2a1f0b8e4c3e2a1f0b8e4c3e2a1f0b8e4'
+        first_fetch = threading.Event()
+        release = threading.Event()
+        pages = [[{'id': self.user_id}], [{'id': other_user_id}]]
+        errors = []
+
+        def _iter_domain_users(domain_id):
+            users = pages.pop(0)
+            if pages:
+                first_fetch.set()
+                release.wait(5)
+            return iter(users)
+
+        def _refresh():
+            try:
+                index.refresh()
+            except Exception as e:
+                errors.append(e)
+
+        index = logintc.membership.MembershipIndex(self.client,
+                                                   self.domain_id)
+        self.client.iter_domain_users = _iter_domain_users
+
+        first = threading.Thread(target=_refresh)
+        first.start()
+        first_fetch.wait(5)
+        second = threading.Thread(target=_refresh)
+        second.start()
+        time.sleep(0.05)
+        release.set()
+        first.join()
+        second.join()
+
+        self.assertEqual([], errors)
+        self.assertFalse(index.contains(self.user_id))
+        self.assertTrue(index.contains(other_user_id))
+
+    def test_is_domain_user_without_index(self):
+        self.set_response('GET',
+                          '/domains/%s/users/%s' % (self.domain_id,
+                                                    self.user_id),
+                          {'status': '404'},
+                          json.dumps({'errors': [
+                              {'code': 'api.error.notfound.user',
+                               'message': 'User not found.'}]}))
+
+        self.assertFalse(self.client.is_domain_user(self.domain_id,
+                                                    self.user_id))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,226 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import logintc
+from logintc.cache import MemoryCache, SharedCache, _private_directory
+from mock_api import MockAPITestCase
+
+
+class TestLookupCache(MockAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.domain_id = 'fa3df768810f0bcb2bfbf0413bfe072e720deb2e'
+        self.user = {'id': '649fde0d701f636d90ed979bf032b557e48a87cc',
+                     'username': 'jdoe', 'email': 'jdoe@cyphercor.com',
+                     'name': 'John Doe', 'domains': []}
+        self.user_path = '/users/%s' % self.user['id']
+
+        self.client = self.mock_client(cache=MemoryCache(ttl=60))
+        self.set_response('GET', self.user_path, {'status': '200'},
+                          json.dumps(self.user))
+
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_cache_hit(self):
+        self.assertEqual(self.user, self.client.get_user(self.user['id']))
+        self.assertEqual(self.user, self.client.get_user(self.user['id']))
+
+        self.assertEqual(1, len(self.requests))
+
+    def test_update_user_invalidates_cache(self):
+        self.client.get_user(self.user['id'])
+        self.set_response('PUT', self.user_path, {'status': '200'},
+                          json.dumps(self.user))
+
+        self.client.update_user(self.user['id'], name='New Name')
+        self.client.get_user(self.user['id'])
+
+        self.assertEqual(3, len(self.requests))
+
+    def test_stale_entry_is_refreshed_in_background(self):
+        key = '%suser:%s' % (self.client._cache_prefix, self.user['id'])
+        self.client.cache.set(key,
+                              json.dumps(dict(self.user, name='Old Name')),
+                              time.time() - 120)
+
+        res = self.client.get_user(self.user['id'])
+
+        self.assertEqual('Old Name', res['name'])
+        for _ in range(100):
+            if self.client.cache.get(key)[1] is False:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.user, self.client.get_user(self.user['id']))
+
+    def test_stale_entries_are_refreshed_by_few_threads(self):
+        release = threading.Event()
+        in_flight = []
+        most = [0]
+
+        def _slow_request(url, method, headers, body=None):
+            in_flight.append(url)
+            most[0] = max(most[0], len(in_flight))
+            release.wait(5)
+            in_flight.remove(url)
+            return {'status': '200'}, json.dumps(self.user)
+
+        self.client.http.request = _slow_request
+        for i in range(50):
+            self.client.cache.set('%suser:%d' % (self.client._cache_prefix, i),
+                                  json.dumps(self.user), time.time() - 120)
+            self.client.get_user(str(i))
+
+        time.sleep(0.1)
+        self.assertEqual(self.client.REFRESH_WORKERS, most[0])
+        release.set()
+        for _ in range(100):
+            if not self.client._refresh_workers:
+                break
+            time.sleep(0.01)
+        self.assertEqual(set(), self.client._refreshing)
+        self.assertEqual(0, self.client._refresh_workers)
+
+    def test_load_snapshot(self):
+        path = os.path.join(self.tmp_dir, 'snapshot.jsonl')
+        with open(path, 'w') as f:
+            f.write(json.dumps({'type': 'user', 'data': self.user}) + '\n')
+            f.write(json.dumps({'type': 'domain',
+                                'data': {'id': self.domain_id,
+                                         'name': 'Cisco ASA'}}) + '\n')
+
+        client = logintc.LoginTC('key', snapshot=path)
+        client.http.request = None
+
+        self.assertEqual(self.user, client.get_user_by_username('jdoe'))
+        self.assertEqual('Cisco ASA', client.get_domain(self.domain_id)['name'])
+
+
+class TestSharedCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'cache.db')
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def open_cache(self, **kwargs):
+        cache = SharedCache(self.path, **kwargs)
+        self.caches.append(cache)
+        return cache
+
+    def test_entries_are_shared(self):
+        writer = self.open_cache(ttl=60)
+        reader = self.open_cache(ttl=60)
+
+        writer.set('user:1', '{"id": "1"}')
+        writer.set('user:2', '{"id": "2"}', time.time() - 120)
+
+        self.assertEqual(('{"id": "1"}', False), reader.get('user:1'))
+        self.assertEqual(('{"id": "2"}', True), reader.get('user:2'))
+        self.assertIsNone(reader.get('user:3'))
+
+        reader.delete('user:1')
+        self.assertIsNone(writer.get('user:1'))
+
+    def test_prune(self):
+        cache = self.open_cache(ttl=60, max_entries=2)
+        cache.set('old', 'x', time.time() - 1000)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, key)
+
+        cache.prune()
+
+        self.assertIsNone(cache.get('old'))
+        self.assertEqual(2, sum(cache.get(key) is not None
+                                for key in ('a', 'b', 'c')))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork')
+    def test_shared_with_forked_process(self):
+        cache = self.open_cache(ttl=60)
+
+        pid = os.fork()
+        if pid == 0:
+            cache.set('domain:1', '{"id": "1"}')
+            os._exit(0)
+
+        os.waitpid(pid, 0)
+        self.assertEqual(('{"id": "1"}', False), cache.get('domain:1'))
+
+    def test_client_uses_shared_cache(self):
+        requests = []
+
+        def _mock_request(url, method, headers, body=None):
+            requests.append(url)
+            return {'status': '200'}, json.dumps({'id': '1'})
+
+        first = logintc.LoginTC('key', cache=self.open_cache())
+        first.http.request = _mock_request
+        second = logintc.LoginTC('key', cache=self.open_cache())
+        second.http.request = _mock_request
+
+        first.get_domain('1')
+        self.assertEqual({'id': '1'}, second.get_domain('1'))
+        self.assertEqual(1, len(requests))
+
+    def test_organizations_do_not_share_entries(self):
+        def _mock_request(name):
+            def request(url, method, headers, body=None):
+                return {'status': '200'}, json.dumps({'id': name,
+                                                      'username': 'jdoe'})
+            return request
+
+        first = logintc.LoginTC('key-a', cache=self.open_cache())
+        first.http.request = _mock_request('a')
+        second = logintc.LoginTC('key-b', cache=self.open_cache())
+        second.http.request = _mock_request('b')
+
+        self.assertEqual('a', first.get_user_by_username('jdoe')['id'])
+        self.assertEqual('b', second.get_user_by_username('jdoe')['id'])
+        self.assertEqual(0o600, os.stat(self.path).st_mode & 0o777)
+
+    def test_snapshot_is_loaded_once_per_host(self):
+        snapshot = os.path.join(self.tmp_dir, 'snapshot.jsonl')
+        with open(snapshot, 'w') as f:
+            f.write(json.dumps({'type': 'domain',
+                                'data': {'id': '1', 'name': 'VPN'}}) + '\n')
+
+        first = logintc.LoginTC('key', cache=self.open_cache())
+        second = logintc.LoginTC('key', cache=self.open_cache())
+
+        self.assertEqual(1, first.load_snapshot(snapshot))
+        self.assertEqual(0, second.load_snapshot(snapshot))
+        second.http.request = None
+        self.assertEqual('VPN', second.get_domain('1')['name'])
+
+    @unittest.skipUnless(hasattr(os, 'geteuid'), 'requires os.geteuid')
+    def test_refuses_files_others_can_access(self):
+        with open(self.path, 'w'):
+            pass
+        os.chmod(self.path, 0o644)
+
+        self.assertRaises(PermissionError, SharedCache, self.path)
+
+    @unittest.skipUnless(hasattr(os, 'geteuid'), 'requires os.geteuid')
+    def test_default_directory_is_private(self):
+        path = _private_directory(self.tmp_dir)
+
+        self.assertEqual(0o700, os.stat(path).st_mode & 0o777)
+        self.assertEqual(path, _private_directory(self.tmp_dir))
+
+        os.chmod(path, 0o755)
+        self.assertRaises(PermissionError, _private_directory, self.tmp_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import io
+import json
+from unittest import mock
+from logintc import cli
+from mock_api import MockAPITestCase
+
+
+class TestCLI(MockAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.domain_id = 'fa3df768810f0bcb2bfbf0413bfe072e720deb2e'
+
+    def test_read_rows(self):
+        ndjson = io.StringIO('{"user_id": "1"}\n\n{"user_id": "2"}\n')
+        csv = io.StringIO('user_id,uses_allowed\n1,3\n2,\n')
+
+        self.assertEqual([{'user_id': '1'}, {'user_id': '2'}],
+                         list(cli.read_rows(ndjson)))
+        self.assertEqual([{'user_id': '1', 'uses_allowed': '3'},
+                          {'user_id': '2'}],
+                         list(cli.read_rows(csv, 'csv')))
+
+    def test_run_with_bad_input(self):
+        for user_id in ('1', '2'):
+            self.set_response('DELETE', '/domains/%s/users/%s' %
+                              (self.domain_id, user_id), {'status': '200'}, '')
+        lines = ['{"user_id": "1"}\n', '{"user_id": \n', '[1]\n',
+                 '{"user_id": "2"}\n']
+
+        def failing_stream():
+            for line in lines:
+                yield line
+            raise IOError('Connection reset')
+
+        out = io.StringIO()
+        counts = cli.run(self.client, 'domain-user-remove',
+                         cli.read_rows(failing_stream()), out,
+                         defaults={'domain_id': self.domain_id})
+
+        self.assertEqual((2, 3), counts)
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(5, len(results))
+        errors = [result['error']['message'] for result in results
+                  if 'error' in result]
+        self.assertTrue(errors[0].startswith('Invalid JSON on line 2'))
+        self.assertEqual('Line 3 is not a JSON object', errors[1])
+        self.assertEqual('Could not read input: Connection reset', errors[2])
+
+    def test_run(self):
+        for user_id in ('1', '2', '3'):
+            self.set_response('PUT', '/domains/%s/users/%s/token' %
+                              (self.domain_id, user_id), {'status': '200'},
+                              json.dumps({'state': 'pending',
+                                          'code': 'code%s' % user_id}))
+        self.set_response('PUT', '/domains/%s/users/4/token' %
+                          self.domain_id, {'status': '404'},
+                          json.dumps({'errors': [
+                              {'code': 'api.error.notfound.user',
+                               'message': 'User not found.'}]}))
+        rows = [{'user_id': user_id} for user_id in ('1', '2', '3', '4')]
+        rows.append({})
+        out = io.StringIO()
+
+        counts = cli.run(self.client, 'token-issue', iter(rows), out,
+                         concurrency=2, defaults={'domain_id': self.domain_id})
+
+        self.assertEqual((3, 2), counts)
+        results = dict((result['input'].get('user_id'), result) for result in
+                       map(json.loads, out.getvalue().splitlines()))
+        self.assertEqual({'state': 'pending', 'code': 'code1'},
+                         results['1']['result'])
+        self.assertEqual('api.error.notfound.user',
+                         results['4']['error']['code'])
+        self.assertEqual('Missing field: user_id',
+                         results[None]['error']['message'])
+
+    def test_main(self):
+        self.set_response('POST', '/users/1/bypasscodes', {'status': '200'},
+                          json.dumps({'code': '123456789'}))
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+
+        with mock.patch.object(cli, 'LoginTC', return_value=self.client):
+            status = cli.main(['--api-key', 'key', '--format', 'csv',
+                               'bypass-issue'],
+                              io.StringIO('user_id,uses_allowed\n1,5\n'),
+                              stdout, stderr)
+
+        self.assertEqual(0, status)
+        self.assertEqual({'input': {'user_id': '1', 'uses_allowed': '5'},
+                          'result': {'code': '123456789'}},
+                         json.loads(stdout.getvalue()))
+        self.assertIn('1 succeeded, 0 failed', stderr.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import json
+import threading
+import logintc
+from logintc.dispatch import SessionDispatcher
+
+
+class TestSessionDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        def _mock_request(url, method, headers, body=None):
+            self.release.wait(5)
+            with self.lock:
+                self.sent.append(json.loads(body)['user']['username'])
+            return {'status': '200'}, json.dumps({'id': 'session',
+                                                  'state': 'pending'})
+
+        self.domain_id = 'fa3df768810f0bcb2bfbf0413bfe072e720deb2e'
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+        self.sent = []
+
+        self.client = logintc.LoginTC('key')
+        self.client.http.request = _mock_request
+
+    def wait_until_busy(self, dispatcher):
+        for _ in range(100):
+            if dispatcher.stats()['active'] == dispatcher.workers:
+                return
+            threading.Event().wait(0.01)
+
+    def test_priority_order(self):
+        dispatcher = SessionDispatcher(self.client, workers=1)
+        first = dispatcher.submit(self.domain_id, username='first')
+        self.wait_until_busy(dispatcher)
+
+        futures = [dispatcher.submit(self.domain_id, username=name,
+                                     priority=priority)
+                   for name, priority in [('low', 5), ('high', 0),
+                                          ('medium', 1)]]
+        self.assertEqual(3, dispatcher.stats()['queued'])
+
+        self.release.set()
+        dispatcher.close()
+
+        self.assertEqual('pending', first.result()['state'])
+        self.assertTrue(all(future.result() for future in futures))
+        self.assertEqual(['first', 'high', 'medium', 'low'], self.sent)
+
+        stats = dispatcher.stats()
+        self.assertEqual(4, stats['completed'])
+        self.assertEqual(0, stats['queued'])
+        self.assertIsNotNone(stats['wait_time']['max'])
+
+    def test_full_queue(self):
+        dispatcher = SessionDispatcher(self.client, workers=1, max_queue=1)
+        dispatcher.submit(self.domain_id, username='first')
+        self.wait_until_busy(dispatcher)
+
+        low = dispatcher.submit(self.domain_id, username='low', priority=5)
+        self.assertRaises(logintc.OverloadedException, dispatcher.submit,
+                          self.domain_id, username='lower', priority=9)
+        high = dispatcher.submit(self.domain_id, username='high', priority=0)
+
+        self.assertRaises(logintc.OverloadedException, low.result, 1)
+        self.release.set()
+        self.assertEqual('pending', high.result(5)['state'])
+        dispatcher.close()
+
+        stats = dispatcher.stats()
+        self.assertEqual(1, stats['rejected'])
+        self.assertEqual(1, stats['shed'])
+        self.assertEqual(['first', 'high'], self.sent)
+
+    def test_expired_in_queue(self):
+        dispatcher = SessionDispatcher(self.client, workers=1)
+        dispatcher.submit(self.domain_id, username='first')
+        self.wait_until_busy(dispatcher)
+
+        future = dispatcher.submit(self.domain_id, username='late',
+                                   timeout=0.05)
+        threading.Event().wait(0.1)
+        self.release.set()
+        dispatcher.close()
+
+        self.assertRaises(logintc.TimeoutException, future.result)
+        self.assertEqual(1, dispatcher.stats()['expired'])
+        self.assertEqual(['first'], self.sent)
+
+if __name__ == '__main__':
+    unittest.main()
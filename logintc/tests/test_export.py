@@ -0,0 +1,101 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import logintc
+from logintc.export import export_snapshot, read_snapshot
+from mock_api import BASE_URI, MockAPITestCase
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class TestExport(MockAPITestCase):
+
+    default_response = ({'status': '200'}, json.dumps([]))
+
+    def setUp(self):
+        super().setUp()
+        self.domain_id = 'fa3df768810f0bcb2bfbf0413bfe072e720deb2e'
+        self.users = [{'id': 'user%d' % i, 'username': 'user%d' % i,
+                       'email': 'user%d@cyphercor.com' % i,
+                       'name': 'User %d' % i,
+                       'domains': [self.domain_id]} for i in range(5)]
+        self.hardware_token = {'id': '0a1b2c', 'alias': 'fob',
+                               'serialNumber': '123'}
+
+        self.set_pages('/users', [self.users[:2], self.users[2:4],
+                                  self.users[4:]])
+        self.set_pages('/hardware', [[self.hardware_token]])
+        self.set_response('GET', '/domains/%s' % self.domain_id,
+                          {'status': '200'},
+                          json.dumps({'id': self.domain_id,
+                                      'name': 'Cisco ASA'}))
+        self.set_pages('/domains/%s/users' % self.domain_id,
+                       [self.users[:3], self.users[3:]])
+        for user in self.users[:4]:
+            self.set_response('GET', '/domains/%s/users/%s/token' %
+                              (self.domain_id, user['id']),
+                              {'status': '200'},
+                              json.dumps({'state': 'active'}))
+        self.set_response('GET', '/domains/%s/users/%s/token' %
+                          (self.domain_id, self.users[4]['id']),
+                          {'status': '404'},
+                          json.dumps({'errors': [
+                              {'code': 'api.error.notfound.token',
+                               'message': 'No token loaded for user.'}]}))
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'snapshot.jsonl.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_export_snapshot(self):
+        counts = export_snapshot(self.client, self.path, [self.domain_id],
+                                 max_workers=2)
+
+        self.assertEqual({'user': 5, 'hardware_token': 1, 'domain': 1,
+                          'domain_user': 5, 'user_token': 4}, counts)
+
+        records = list(read_snapshot(self.path))
+        self.assertEqual([{'type': 'user', 'data': user}
+                          for user in self.users], records[:5])
+        self.assertIn({'type': 'user_token', 'domain_id': self.domain_id,
+                       'user_id': 'user0', 'data': {'state': 'active'}},
+                      records)
+        self.assertFalse(os.path.exists(self.path + '.state'))
+
+    def test_resume_export(self):
+        page = '/domains/%s/users?page=2' % self.domain_id
+        saved = self.responses.pop(('GET', BASE_URI + page))
+        self.set_response('GET', page, {'status': '500'}, '')
+
+        self.assertRaises(logintc.InternalAPIException, export_snapshot,
+                          self.client, self.path, [self.domain_id])
+        self.assertTrue(os.path.exists(self.path + '.state'))
+
+        self.set_response('GET', page, *saved)
+        counts = export_snapshot(self.client, self.path, [self.domain_id],
+                                 resume=True)
+
+        self.assertEqual({'user': 5, 'hardware_token': 1, 'domain': 1,
+                          'domain_user': 5, 'user_token': 4}, counts)
+        records = list(read_snapshot(self.path))
+        self.assertEqual(16, len(records))
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_export_parquet(self):
+        path = os.path.join(self.tmp_dir, 'snapshot')
+
+        export_snapshot(self.client, path, [self.domain_id], format='parquet')
+
+        table = pyarrow.parquet.read_table(os.path.join(path, 'user.parquet'))
+        self.assertEqual(['user%d' % i for i in range(5)],
+                         table.column('id').to_pylist())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import os
+import subprocess
+import sys
+
+import logintc
+
+# Cumulative time, in microseconds, that 'import logintc' may take.
+IMPORT_TIME_BUDGET_US = 20000
+
+
+class TestImport(unittest.TestCase):
+
+    def run_python(self, code, *options):
+        root = os.path.dirname(os.path.dirname(
+            os.path.abspath(logintc.__file__)))
+        return subprocess.run([sys.executable] + list(options) + ['-c', code],
+                              cwd=root, capture_output=True,
+                              universal_newlines=True, check=True)
+
+    def test_import_does_not_load_transport(self):
+        result = self.run_python(
+            'import sys, logintc; '
+            'print(sorted(m for m in ("httplib2", "json", "logintc.client") '
+            'if m in sys.modules))')
+
+        self.assertEqual('[]', result.stdout.strip())
+
+    def test_client_is_loaded_on_first_use(self):
+        result = self.run_python(
+            'import sys, logintc; logintc.LoginTC("key"); '
+            'print("httplib2" in sys.modules)')
+
+        self.assertEqual('True', result.stdout.strip())
+
+    def test_import_time_budget(self):
+        result = self.run_python('import logintc', '-X', 'importtime')
+
+        for line in result.stderr.splitlines():
+            fields = [field.strip() for field in line.split('|')]
+            if len(fields) == 3 and fields[2] == 'logintc':
+                self.assertLess(int(fields[1]), IMPORT_TIME_BUDGET_US)
+                break
+        else:
+            self.fail('logintc not found in -X importtime output')
+
+if __name__ == '__main__':
+    unittest.main()
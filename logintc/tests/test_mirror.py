@@ -0,0 +1,89 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from logintc.mirror import Mirror
+from mock_api import MockAPITestCase
+
+
+class TestMirror(MockAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.domain_id = 'fa3df768810f0bcb2bfbf0413bfe072e720deb2e'
+        self.user = {'id': '649fde0d701f636d90ed979bf032b557e48a87cc',
+                     'username': 'jdoe', 'email': 'jdoe@cyphercor.com',
+                     'name': 'John Doe', 'domains': [self.domain_id]}
+        self.other_user = {'id': 'b8e4c3e2a1f0b8e4c3e2a1f0b8e4c3e2a1f0b8e4',
+                           'username': 'asmith',
+                           'email': 'asmith@cyphercor.com',
+                           'name': 'Alice Smith', 'domains': []}
+        self.hardware_token = {'id': '0a1b2c', 'alias': 'fob',
+                               'serialNumber': '123'}
+        self.bypass_code = {'id': 'c0ffee', 'code': '123456789',
+                            'usesRemaining': 1}
+
+        self.set_pages('/users', [[self.user, self.other_user]])
+        self.set_pages('/domains/%s/users' % self.domain_id, [[self.user]])
+        self.set_pages('/hardware', [[self.hardware_token]])
+        self.set_response('GET', '/users/%s/bypasscodes' % self.user['id'],
+                          {'status': '200'}, json.dumps([self.bypass_code]))
+        self.set_response('GET',
+                          '/users/%s/bypasscodes' % self.other_user['id'],
+                          {'status': '200'}, json.dumps([]))
+
+        self.mirror = Mirror(self.client, [self.domain_id], bypass_codes=True)
+
+    def tearDown(self):
+        self.mirror.close()
+
+    def test_lookups(self):
+        self.assertEqual(5, self.mirror.refresh())
+
+        self.assertEqual(self.user, self.mirror.get_user(self.user['id']))
+        self.assertEqual(self.other_user,
+                         self.mirror.get_user_by_username('asmith'))
+        self.assertIsNone(self.mirror.get_user_by_username('nobody'))
+        self.assertEqual([self.user],
+                         self.mirror.get_domain_users(self.domain_id))
+        self.assertEqual([self.domain_id],
+                         self.mirror.get_user_domain_ids(self.user['id']))
+        self.assertTrue(self.mirror.is_domain_user(self.domain_id,
+                                                   self.user['id']))
+        self.assertFalse(self.mirror.is_domain_user(self.domain_id,
+                                                    self.other_user['id']))
+        self.assertEqual([self.hardware_token],
+                         self.mirror.get_hardware_tokens())
+        self.assertEqual([{'id': 'c0ffee', 'usesRemaining': 1}],
+                         self.mirror.get_bypass_codes(self.user['id']))
+
+    def test_refresh_is_incremental(self):
+        self.mirror.refresh()
+
+        self.assertEqual(0, self.mirror.refresh())
+
+        renamed = dict(self.other_user, name='Alice Jones')
+        self.set_pages('/users', [[self.user, renamed]])
+        self.set_pages('/domains/%s/users' % self.domain_id, [[]])
+
+        self.assertEqual(2, self.mirror.refresh())
+        self.assertEqual('Alice Jones',
+                         self.mirror.get_user(renamed['id'])['name'])
+        self.assertEqual([], self.mirror.get_domain_users(self.domain_id))
+
+    def test_file_is_private_and_holds_no_codes(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'mirror.db')
+
+        mirror = Mirror(self.client, bypass_codes=True, path=path)
+        mirror.refresh()
+        mirror.close()
+
+        self.assertEqual(0o600, os.stat(path).st_mode & 0o777)
+        with open(path, 'rb') as f:
+            self.assertNotIn(b'123456789', f.read())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+import gzip
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+import logintc
+from logintc.recording import RecordingTransport, ReplayTransport
+
+
+class _MockTransport(object):
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    def request(self, uri, method, headers=None, body=None):
+        response = self.responses[(method, uri)]
+        if isinstance(response, Exception):
+            raise response
+        time.sleep(0.05)
+        return response
+
+
+class TestRecording(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'traffic.jsonl.gz')
+
+        self.domain_id = 'fa3df768810f0bcb2bfbf0413bfe072e720deb2e'
+        self.user_id = '649fde0d701f636d90ed979bf032b557e48a87cc'
+        base = 'https://cloud.logintc.com/api'
+        self.transport = _MockTransport({
+            ('GET', '%s/users/%s' % (base, self.user_id)):
+                ({'status': '200'}, b'{"id": "%s"}' % self.user_id.encode()),
+            ('POST', '%s/users/%s/bypasscodes' % (base, self.user_id)):
+                ({'status': '201'}, b'{"id": "1", "code": "123456789"}'),
+            ('GET', '%s/domains/%s/users/%s/token' %
+             (base, self.domain_id, self.user_id)):
+                ({'status': '404'}, json.dumps({'errors': [{
+                    'code': 'api.error.notfound.token',
+                    'message': 'No token loaded for user.'}]}).encode()),
+            ('GET', '%s/domains/%s/image' % (base, self.domain_id)):
+                ({'status': '200'}, b'\x89PNG\r\n\x1a\n\xff'),
+            ('GET', '%s/ping' % base): socket.timeout('timed out'),
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def record(self):
+        client = logintc.LoginTC('secret-key')
+        client.http = RecordingTransport(self.transport, self.path)
+
+        client.get_user(self.user_id)
+        client.create_bypass_code(self.user_id)
+        self.assertRaises(logintc.NoTokenException, client.get_user_token,
+                          self.domain_id, self.user_id)
+        client.get_domain_image(self.domain_id)
+        self.assertRaises(logintc.TimeoutException, client.get_ping)
+
+        client.http.close()
+
+    def test_secrets_are_redacted(self):
+        self.record()
+
+        with gzip.open(self.path, 'rt') as f:
+            recording = f.read()
+
+        self.assertNotIn('secret-key', recording)
+        self.assertNotIn('123456789', recording)
+        self.assertIn('api.error.notfound.token', recording)
+
+    def test_session_secrets_are_redacted(self):
+        path = '/domains/%s/sessions' % self.domain_id
+        self.transport.responses[('POST', 'https://cloud.logintc.com/api' +
+                                  path)] = ({'status': '200'},
+                                            b'{"id": "1", "state": "pending"}')
+
+        client = logintc.LoginTC('secret-key')
+        client.http = RecordingTransport(self.transport, self.path)
+        client.create_session(self.domain_id, username='jdoe',
+                              bypass_code='123456789')
+        client.create_session(self.domain_id, username='jdoe', otp='987654')
+        client.http.close()
+
+        with gzip.open(self.path, 'rt') as f:
+            recording = f.read()
+
+        self.assertNotIn('123456789', recording)
+        self.assertNotIn('987654', recording)
+
+    def test_replay(self):
+        self.record()
+
+        client = logintc.LoginTC('key', host='example.com')
+        client.http = ReplayTransport(self.path)
+
+        self.assertEqual(self.user_id, client.get_user(self.user_id)['id'])
+        self.assertEqual('REDACTED',
+                         client.create_bypass_code(self.user_id)['code'])
+        self.assertRaises(logintc.NoTokenException, client.get_user_token,
+                          self.domain_id, self.user_id)
+        self.assertEqual(b'\x89PNG\r\n\x1a\n\xff',
+                         client.get_domain_image(self.domain_id))
+        self.assertRaises(logintc.TimeoutException, client.get_ping)
+        self.assertRaises(KeyError, client.get_user, 'unknown')
+
+    def test_replay_at_recorded_speed(self):
+        self.record()
+
+        client = logintc.LoginTC('key')
+        client.http = ReplayTransport(self.path)
+        start = time.monotonic()
+        client.get_user(self.user_id)
+        self.assertLess(time.monotonic() - start, 0.05)
+
+        client.http = ReplayTransport(self.path, speed=1.0)
+        start = time.monotonic()
+        client.get_user(self.user_id)
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import io
+import json
+from logintc.report import HealthReport
+from mock_api import MockAPITestCase
+
+
+class TestHealthReport(MockAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.domain_id = 'fa3df768810f0bcb2bfbf0413bfe072e720deb2e'
+        self.users = [{'id': 'user%d' % i, 'username': 'user%d' % i,
+                       'domains': [self.domain_id]} for i in range(3)]
+
+        self.set_pages('/users', [self.users[:2], self.users[2:]])
+        self.set_pages('/hardware', [[{'id': 'hw0'}, {'id': 'hw1'}]])
+
+        token_path = '/domains/%s/users/%%s/token' % self.domain_id
+        self.set_response('GET', token_path % 'user0', {'status': '200'},
+                          json.dumps({'state': 'active'}))
+        self.set_response('GET', token_path % 'user1', {'status': '200'},
+                          json.dumps({'state': 'pending'}))
+        self.set_not_found(token_path % 'user2', 'api.error.notfound.token')
+
+        self.set_response('GET', '/users/user0/bypasscodes',
+                          {'status': '200'},
+                          json.dumps([{'id': 'b0', 'usesRemaining': 1},
+                                      {'id': 'b1', 'usesRemaining': 0}]))
+        for user_id in ('user1', 'user2'):
+            self.set_response('GET', '/users/%s/bypasscodes' % user_id,
+                              {'status': '200'}, json.dumps([]))
+
+        self.set_response('GET', '/users/user0/hardware', {'status': '200'},
+                          json.dumps({'id': 'hw0'}))
+        for user_id in ('user1', 'user2'):
+            self.set_not_found('/users/%s/hardware' % user_id,
+                               'api.error.notfound.hardware')
+
+    def test_report(self):
+        out = io.StringIO()
+        progress = []
+
+        totals = HealthReport(self.client, progress=lambda *args:
+                              progress.append(args), total_users=3).run(out)
+
+        self.assertEqual({'users': 3, 'no_active_token': {self.domain_id: 2},
+                          'live_bypass_codes': 1,
+                          'unassigned_hardware_tokens': 1, 'errors': 0},
+                         totals)
+        findings = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertIn({'finding': 'no_active_token',
+                       'domain_id': self.domain_id, 'user_id': 'user2',
+                       'username': 'user2', 'state': None}, findings)
+        self.assertIn({'finding': 'live_bypass_codes', 'user_id': 'user0',
+                       'username': 'user0', 'count': 1}, findings)
+        self.assertEqual({'finding': 'unassigned_hardware_token',
+                          'hardware_token_id': 'hw1'}, findings[-1])
+        self.assertEqual([2, 3], [done for done, _, _ in progress])
+        self.assertEqual(0, progress[-1][2])
+
+if __name__ == '__main__':
+    unittest.main()
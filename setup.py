@@ -14,7 +14,12 @@ setup(
     description='API client for LoginTC two-factor authentication.',
     long_description=open('README.rst', 'rt').read(),
     keywords=['logintc', 'two-factor', 'authentication', 'security'],
-    install_requires=['httplib2 >= 0.9.2'],
+    python_requires='>=3.7',
+    install_requires=['httplib2 >= 0.11.0'],
+    extras_require={'parquet': ['pyarrow'], 'brotli': ['brotli']},
+    entry_points={'console_scripts': ['logintc = logintc.cli:main']},
     classifiers=['Topic :: Security',
-                 'License :: OSI Approved :: BSD License']
+                 'License :: OSI Approved :: BSD License',
+                 'Programming Language :: Python :: 3',
+                 'Programming Language :: Python :: 3 :: Only']
 )